@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""In-process load test for the API with local stand-ins for every dependency.
+
+Boots server.app (including its lifespan) behind httpx's ASGI transport, backed
+by mongomock-motor (or a real mongod via --mongo-url), a fake OAuth
+session-data endpoint and the in-memory FakePaymentGateway. Concurrent
+workers replay a weighted mix of routes and the per-route latency
+percentiles and throughput are written as JSON, so runs on different commits
+can be compared directly.
+
+Usage (from the backend directory; needs `pip install mongomock-motor` unless
+--mongo-url is given):
+    python benchmarks/load_test.py --concurrency 32 --duration 20 \
+        --mix videos=50,video=25,me=15,payment_status=8,login=2 --output bench.json
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "load_test")
+os.environ["PAYMENT_GATEWAY"] = "fake"
+os.environ.setdefault("FAKE_PAYMENT_PAID_AFTER_POLLS", "1000000")
+os.environ.setdefault("AUTH_BASE_URL", "http://auth.local")
+# Every simulated client shares one address; lift per-client budgets unless set explicitly
+for budget in ("RATE_LIMIT_LOGIN", "RATE_LIMIT_CHECKOUT", "RATE_LIMIT_PAYMENT_STATUS"):
+    os.environ.setdefault(budget, "1000000,1000000")
+os.environ.setdefault("THUMBNAIL_DIR", tempfile.mkdtemp(prefix="load-test-thumbs-"))
+
+import httpx
+
+import server
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+DEFAULT_MIX = "videos=50,video=25,me=15,payment_status=8,login=2"
+
+def fake_auth_handler(request: httpx.Request) -> httpx.Response:
+    """Stand-in for the OAuth provider's session-data endpoint"""
+    session_id = request.headers.get("X-Session-ID", "")
+    return httpx.Response(200, json={
+        "email": f"{session_id}@load.test",
+        "name": f"Load {session_id}",
+        "picture": None,
+        "session_token": f"tok_{uuid.uuid4().hex}"
+    })
+
+async def seed(videos: int, users: int, premium_share: float) -> tuple:
+    """Insert a catalog and logged-in users; returns their session tokens and the premium ones"""
+    now = datetime.now(timezone.utc)
+    await server.db.videos.insert_many([
+        {
+            "video_id": f"vid_{i:012x}",
+            "title": f"Technique {i}",
+            "description": "Set up, level change, finish. " * 4,
+            "category": ["Takedowns", "Escapes", "Pins", "Defense"][i % 4],
+            "video_url": f"https://www.youtube.com/embed/{i:011d}",
+            "thumbnail_url": None,
+            "is_premium": i % 3 == 0,
+            "order": i + 1,
+            "created_at": now
+        }
+        for i in range(videos)
+    ])
+    tokens = []
+    premium_tokens = set()
+    user_docs = []
+    session_docs = []
+    for i in range(users):
+        premium = i < users * premium_share
+        user_docs.append({
+            "user_id": f"user_load{i:06d}",
+            "email": f"load{i}@load.test",
+            "name": f"Load {i}",
+            "picture": None,
+            "subscription_plan": "monthly" if premium else "free",
+            "subscription_expires": now + timedelta(days=30) if premium else None,
+            "has_premium": premium,
+            "created_at": now
+        })
+        token = f"tok_load{i:06d}"
+        session_docs.append({"session_token": token, "user_id": f"user_load{i:06d}", "expires_at": now + timedelta(days=7), "created_at": now})
+        tokens.append(token)
+        if premium:
+            premium_tokens.add(token)
+    await server.db.users.insert_many(user_docs)
+    await server.db.user_sessions.insert_many(session_docs)
+    return tokens, premium_tokens
+
+def parse_mix(spec: str) -> dict:
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight)
+    unknown = set(mix) - set(ROUTES)
+    if unknown:
+        raise SystemExit(f"Unknown routes in mix: {', '.join(sorted(unknown))} (known: {', '.join(ROUTES)})")
+    return mix
+
+async def route_videos(client, token, state):
+    return await client.get("/api/videos", headers={"Authorization": f"Bearer {token}"})
+
+async def route_video(client, token, state):
+    # Free users only open free videos (every third one is premium), so a 403 is a real error
+    index = random.randrange(state["videos"])
+    if token not in state["premium_tokens"] and index % 3 == 0:
+        # Step to a neighbouring free video without wrapping back to premium vid_0
+        index = index + 1 if index + 1 < state["videos"] else index - 1
+    video_id = f"vid_{index:012x}"
+    return await client.get(f"/api/videos/{video_id}", headers={"Authorization": f"Bearer {token}"})
+
+async def route_me(client, token, state):
+    return await client.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+
+async def route_payment_status(client, token, state):
+    session_id = state["checkouts"].get(token)
+    if session_id is None:
+        checkout = await client.post(
+            "/api/payments/create-checkout",
+            headers={"Authorization": f"Bearer {token}"},
+            json={"plan": "monthly", "origin_url": "http://load.test"}
+        )
+        session_id = state["checkouts"][token] = checkout.json()["session_id"]
+    return await client.get(f"/api/payments/status/{session_id}", headers={"Authorization": f"Bearer {token}"})
+
+async def route_login(client, token, state):
+    return await client.post("/api/auth/session", json={"session_id": f"login{random.randrange(1000)}"})
+
+ROUTES = {
+    "videos": route_videos,
+    "video": route_video,
+    "me": route_me,
+    "payment_status": route_payment_status,
+    "login": route_login,
+}
+
+def percentile(samples: list, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))] if samples else 0.0
+
+async def worker(client, tokens, mix, state, deadline, results):
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    while time.perf_counter() < deadline:
+        name = random.choices(names, weights)[0]
+        token = random.choice(tokens)
+        started = time.perf_counter()
+        try:
+            response = await ROUTES[name](client, token, state)
+            status = f"{response.status_code // 100}xx"
+            # 4xx (including 429 from the rate limiter) counts too: it is not a served request
+            ok = 200 <= response.status_code < 300 or response.status_code == 304
+        except Exception:
+            status = "exception"
+            ok = False
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        bucket = results.setdefault(name, {"latencies": [], "errors": 0, "statuses": {}})
+        bucket["latencies"].append(elapsed_ms)
+        bucket["statuses"][status] = bucket["statuses"].get(status, 0) + 1
+        if not ok:
+            bucket["errors"] += 1
+        # In-process stand-ins can complete a request without ever suspending;
+        # yield so one worker cannot starve the others
+        await asyncio.sleep(0)
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+async def run(args) -> dict:
+    if args.mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo = AsyncIOMotorClient(args.mongo_url, tz_aware=True)
+        await mongo.drop_database(os.environ["DB_NAME"])
+        server.db = mongo[os.environ["DB_NAME"]]
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        server.db = AsyncMongoMockClient(tz_aware=True)[os.environ["DB_NAME"]]
+
+    tokens, premium_tokens = await seed(args.videos, args.users, args.premium_share)
+    mix = parse_mix(args.mix)
+    state = {"videos": args.videos, "premium_tokens": premium_tokens, "checkouts": {}}
+    results = {}
+
+    async with server.lifespan(server.app):
+        server.auth_client.http = httpx.AsyncClient(base_url=server.auth_client.base_url, transport=httpx.MockTransport(fake_auth_handler))
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://api.local") as client:
+            # Warm caches so the run measures steady state
+            await asyncio.gather(*(route_videos(client, token, state) for token in tokens[:4]))
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*(worker(client, tokens, mix, state, deadline, results) for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "concurrency": args.concurrency,
+            "duration_s": args.duration,
+            "videos": args.videos,
+            "users": args.users,
+            "mix": mix,
+            "mongo": args.mongo_url or "mongomock"
+        },
+        "routes": {}
+    }
+    total = 0
+    for name, bucket in sorted(results.items()):
+        latencies = sorted(bucket["latencies"])
+        total += len(latencies)
+        report["routes"][name] = {
+            "requests": len(latencies),
+            "errors": bucket["errors"],
+            "statuses": dict(sorted(bucket["statuses"].items())),
+            "rps": round(len(latencies) / elapsed, 1),
+            "p50_ms": round(percentile(latencies, 0.50), 3),
+            "p95_ms": round(percentile(latencies, 0.95), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "max_ms": round(latencies[-1], 3) if latencies else 0.0
+        }
+    report["total_rps"] = round(total / elapsed, 1)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process API load test")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--videos", type=int, default=500)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--premium-share", type=float, default=0.3)
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"route=weight,... (default {DEFAULT_MIX})")
+    parser.add_argument("--mongo-url", help="use a real mongod instead of mongomock (its database is dropped first)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Latency of the in-memory video search index on a synthetic catalog.
+
+Builds SearchIndex over generated videos and times search() and suggest()
+for a mix of full-word, multi-word and partial-word queries.
+
+Usage (from the backend directory):
+    python benchmarks/search_latency.py [--videos 50000] [--queries 5000]
+"""
+
+import argparse
+import gc
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+os.environ.setdefault("THUMBNAIL_DIR", tempfile.mkdtemp(prefix="thumb-bench-"))
+
+import server
+
+WORDS = (
+    "single double leg high crotch sweep fireman carry ankle pick snap down front headlock "
+    "go behind duck under arm drag whizzer sprawl stand up sit out switch granby roll "
+    "half nelson cradle tilt turk leg ride mat return escape reversal pin near fall bridge "
+    "underhook overhook collar tie two on one russian body lock suplex throw hip toss "
+    "setup finish chain defense counter drill position stance motion level change penetration"
+).split()
+CATEGORIES = ["Takedowns", "Escapes", "Pins", "Defense", "Top Control", "Bottom", "Conditioning", "Drills"]
+
+def make_catalog(count: int, rng: random.Random) -> list:
+    # Per-video id tokens give a long tail of rare terms, like real titles
+    return [
+        {
+            "video_id": f"vid_{i:08x}",
+            "title": " ".join(rng.choices(WORDS, k=rng.randint(2, 5))) + f" v{i}",
+            "description": " ".join(rng.choices(WORDS, k=rng.randint(10, 30))),
+            "category": rng.choice(CATEGORIES),
+            "is_premium": rng.random() < 0.4,
+            "order": i
+        }
+        for i in range(count)
+    ]
+
+def make_query(rng: random.Random) -> str:
+    kind = rng.random()
+    if kind < 0.4:
+        return rng.choice(WORDS)
+    if kind < 0.7:
+        return " ".join(rng.sample(WORDS, 2))
+    word = rng.choice([w for w in WORDS if len(w) > 3])
+    return word[:rng.randint(2, len(word) - 1)]
+
+def percentile(samples: list, fraction: float) -> float:
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Search index latency")
+    parser.add_argument("--videos", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    videos = make_catalog(args.videos, rng)
+    index = server.SearchIndex()
+    started = time.perf_counter()
+    index.rebuild(videos)
+    print(f"Indexed {args.videos} videos ({len(index.vocabulary)} terms) in {time.perf_counter() - started:.2f} s")
+
+    queries = [make_query(rng) for _ in range(args.queries)]
+    # Collect build garbage up front so a full collection does not land mid-run
+    gc.collect()
+    for name, run in (("search", lambda q: index.search(q, args.limit)), ("suggest", index.suggest)):
+        samples = []
+        for query in queries:
+            started = time.perf_counter()
+            run(query)
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        print(f"{name}: p50={percentile(samples, 0.5):.3f} ms  p95={percentile(samples, 0.95):.3f} ms  "
+              f"p99={percentile(samples, 0.99):.3f} ms  max={samples[-1]:.3f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Encode time for the /api/videos payload under each serialization path.
+
+Compares the previous path (jsonable_encoder + json.dumps, as FastAPI's
+default JSONResponse does for raw dicts), the response_model path with
+ORJSONResponse (pydantic-core serialization + orjson), and the pre-serialized
+catalog bytes now sent by get_videos.
+
+Usage (from the backend directory):
+    python benchmarks/serialization.py [--videos 1000] [--rounds 200]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+os.environ.setdefault("THUMBNAIL_DIR", tempfile.mkdtemp(prefix="thumb-bench-"))
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+
+import server
+
+def make_videos(count: int) -> list:
+    return [
+        {
+            "video_id": f"vid_{i:012x}",
+            "title": f"Technique {i}: single leg finish from the outside",
+            "description": "Set up with a collar tie, change levels and finish by running the pipe. " * 3,
+            "category": ["Takedowns", "Escapes", "Pins", "Defense"][i % 4],
+            "video_url": f"https://www.youtube.com/embed/{i:011d}",
+            "thumbnail_url": f"/api/thumbnails/{i:064x}.jpg",
+            "is_premium": i % 3 == 0,
+            "order": i,
+            "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc),
+            "is_locked": i % 3 == 0
+        }
+        for i in range(count)
+    ]
+
+def previous_path(videos: list) -> bytes:
+    return json.dumps(jsonable_encoder(videos), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def response_model_path(videos: list) -> bytes:
+    validated = server.VIDEO_LIST_ADAPTER.validate_python(videos)
+    return orjson.dumps(server.VIDEO_LIST_ADAPTER.dump_python(validated, mode="json"))
+
+def time_it(function, videos: list, rounds: int) -> list:
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        function(videos)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description="Catalog serialization benchmark")
+    parser.add_argument("--videos", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+    videos = make_videos(args.videos)
+    snapshot_bytes = response_model_path(videos)
+
+    paths = (
+        ("jsonable_encoder + json", previous_path),
+        ("response_model + orjson", response_model_path),
+        ("pre-serialized snapshot", lambda _: snapshot_bytes),
+    )
+    baseline = None
+    for name, function in paths:
+        samples = time_it(function, videos, args.rounds)
+        median = statistics.median(samples)
+        baseline = baseline or median
+        speedup = f"{baseline / median:7.1f}x" if median >= 0.001 else "   >1000x"
+        print(f"{name:26s} median={median:8.3f} ms  speedup={speedup}")
+
+if __name__ == "__main__":
+    main()
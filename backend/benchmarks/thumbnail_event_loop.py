@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Measure event-loop latency while thumbnails are processed concurrently.
+
+Compares resizing on the event loop (the old behaviour) with the process-pool
+pipeline used by upload_thumbnail. A ticker coroutine sleeps for a fixed
+interval and records how late it wakes up; a flat lag profile means other
+requests on the worker keep being served during uploads.
+
+Usage (from the backend directory):
+    python benchmarks/thumbnail_event_loop.py [--uploads 8] [--size 3000x2000]
+"""
+
+import argparse
+import asyncio
+import io
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "benchmark")
+os.environ.setdefault("THUMBNAIL_DIR", tempfile.mkdtemp(prefix="thumb-bench-"))
+
+from PIL import Image
+
+import server
+
+TICK_SECONDS = 0.005
+
+async def ticker(lags: list, stop: asyncio.Event):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK_SECONDS)
+        lags.append((time.perf_counter() - start - TICK_SECONDS) * 1000)
+
+def make_upload(width: int, height: int, seed: int) -> bytes:
+    image = Image.effect_noise((width, height), 64 + seed).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=95)
+    return buffer.getvalue()
+
+async def process(data: bytes, use_pool: bool):
+    name = await asyncio.to_thread(server.thumbnail_store.save_bytes, data, "image/jpeg")
+    args = (str(server.thumbnail_store.path_for(name)), server.ThumbnailStore.VARIANT_WIDTHS, 80)
+    if use_pool:
+        await asyncio.get_running_loop().run_in_executor(server.get_thumbnail_pool(), server.render_thumbnail_variants, *args)
+    else:
+        server.render_thumbnail_variants(*args)
+
+async def run(uploads: list, use_pool: bool) -> dict:
+    lags = []
+    stop = asyncio.Event()
+    tick_task = asyncio.create_task(ticker(lags, stop))
+    await asyncio.sleep(0.05)
+    start = time.perf_counter()
+    await asyncio.gather(*(process(data, use_pool) for data in uploads))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await tick_task
+    lags.sort()
+    return {
+        "mode": "process-pool" if use_pool else "event-loop",
+        "wall_s": round(elapsed, 3),
+        "lag_p50_ms": round(statistics.median(lags), 2),
+        "lag_p99_ms": round(lags[min(len(lags) - 1, int(len(lags) * 0.99))], 2),
+        "lag_max_ms": round(lags[-1], 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Event-loop lag during thumbnail processing")
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--size", default="3000x2000")
+    args = parser.parse_args()
+    width, height = (int(part) for part in args.size.split("x"))
+
+    # Distinct images per run so content-hash dedupe does not skip the work
+    inline_uploads = [make_upload(width, height, i) for i in range(args.uploads)]
+    pool_uploads = [make_upload(width, height, args.uploads + i) for i in range(args.uploads)]
+
+    server.get_thumbnail_pool().submit(int, 0).result()  # warm up workers
+    for result in (asyncio.run(run(inline_uploads, False)), asyncio.run(run(pool_uploads, True))):
+        print(result)
+    server.get_thumbnail_pool().shutdown()
+
+if __name__ == "__main__":
+    main()
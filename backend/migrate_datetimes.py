@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Convert ISO-string timestamps to native BSON dates in place.
+
+Usage (from the backend directory):
+    python migrate_datetimes.py [--batch-size 500] [--collection users] [--restart]
+
+Progress is checkpointed per collection in the `migrations` collection, so an
+interrupted run resumes where it stopped; --restart ignores the checkpoint.
+"""
+
+import argparse
+import asyncio
+
+from pymongo import UpdateOne
+
+from server import db, client, as_utc
+
+DATETIME_FIELDS = {
+    "users": ["created_at", "subscription_expires"],
+    "user_sessions": ["expires_at", "created_at"],
+    "videos": ["created_at"],
+    "payment_transactions": ["created_at"],
+}
+
+async def migrate_collection(collection_name: str, fields: list, batch_size: int, restart: bool):
+    checkpoint_id = f"datetimes:{collection_name}"
+    string_query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    remaining = await db[collection_name].count_documents(string_query)
+    print(f"{collection_name}: {remaining} documents with string timestamps")
+
+    checkpoint = None if restart else await db.migrations.find_one({"_id": checkpoint_id})
+    last_id = checkpoint.get("last_id") if checkpoint and not checkpoint.get("completed") else None
+    converted = 0
+    failed = 0
+    while True:
+        query = dict(string_query)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await db[collection_name].find(
+            query, {field: 1 for field in fields}
+        ).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            break
+
+        updates = []
+        for doc in batch:
+            values = {}
+            for field in fields:
+                if isinstance(doc.get(field), str):
+                    try:
+                        values[field] = as_utc(doc[field])
+                    except ValueError:
+                        failed += 1
+            if values:
+                updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": values}))
+        if updates:
+            await db[collection_name].bulk_write(updates, ordered=False)
+
+        converted += len(updates)
+        last_id = batch[-1]["_id"]
+        await db.migrations.update_one(
+            {"_id": checkpoint_id},
+            {"$set": {"last_id": last_id, "converted": converted, "completed": False}},
+            upsert=True
+        )
+        print(f"  {collection_name}: {converted}/{remaining} converted")
+
+    await db.migrations.update_one({"_id": checkpoint_id}, {"$set": {"completed": True}}, upsert=True)
+    print(f"{collection_name}: done ({converted} converted, {failed} unparseable values left as-is)")
+
+async def migrate(collections: list, batch_size: int, restart: bool):
+    for collection_name in collections:
+        await migrate_collection(collection_name, DATETIME_FIELDS[collection_name], batch_size, restart)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--collection", choices=sorted(DATETIME_FIELDS), action="append")
+    parser.add_argument("--restart", action="store_true")
+    args = parser.parse_args()
+    try:
+        asyncio.run(migrate(args.collection or list(DATETIME_FIELDS), args.batch_size, args.restart))
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
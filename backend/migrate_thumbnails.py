@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Move base64 data-URL thumbnails out of `videos` documents into the thumbnail store.
+
+Usage (from the backend directory, with THUMBNAIL_DIR on persistent storage):
+    python migrate_thumbnails.py [--batch-size 50] [--dry-run]
+    python migrate_thumbnails.py --verify
+
+The first form stores each data URL and its variants, points thumbnail_url
+at the stored file and keeps the data URL in thumbnail_url_backup. --verify
+drops a backup only once the original and every variant are on disk; missing
+files are re-created from the backup, which is then kept for the next run.
+
+Safe to re-run: only documents whose thumbnail_url still starts with "data:"
+(or, with --verify, that still have a backup) are touched. Restart the API
+afterwards so its catalog snapshot is rebuilt.
+"""
+
+import argparse
+import asyncio
+import base64
+import binascii
+import re
+
+from server import db, client, thumbnail_store, render_thumbnail_variants, ThumbnailStore
+
+DATA_URL_PATTERN = re.compile(r'^data:(image/[a-z]+);base64,(.*)$', re.DOTALL)
+
+def decode_data_url(data_url: str):
+    """(content type, bytes) of a supported data URL; raises ValueError otherwise"""
+    match = DATA_URL_PATTERN.match(data_url)
+    if not match or match.group(1) not in thumbnail_store.EXTENSIONS:
+        raise ValueError("unsupported data URL")
+    try:
+        return match.group(1), base64.b64decode(match.group(2), validate=True)
+    except binascii.Error:
+        raise ValueError("invalid base64")
+
+async def store(content_type: str, data: bytes) -> str:
+    """Save the original and render its variants; returns the stored name"""
+    name = await asyncio.to_thread(thumbnail_store.save_bytes, data, content_type)
+    await asyncio.to_thread(
+        render_thumbnail_variants,
+        str(thumbnail_store.path_for(name)),
+        ThumbnailStore.VARIANT_WIDTHS,
+        80
+    )
+    return name
+
+def missing_files(name: str) -> list:
+    names = [name] + [
+        thumbnail_store.variant_name(name, width, extension)
+        for width in ThumbnailStore.VARIANT_WIDTHS
+        for extension in ThumbnailStore.VARIANT_FORMATS
+    ]
+    return [candidate for candidate in names if not thumbnail_store.path_for(candidate).is_file()]
+
+async def batches(query: dict, projection: dict, batch_size: int):
+    last_id = None
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        batch = await db.videos.find(batch_query, projection).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return
+        last_id = batch[-1]["_id"]
+        yield batch
+
+async def migrate(batch_size: int, dry_run: bool):
+    query = {"thumbnail_url": {"$regex": "^data:"}}
+    total = await db.videos.count_documents(query)
+    print(f"Found {total} videos with data-URL thumbnails")
+
+    migrated = 0
+    skipped = 0
+    async for batch in batches(query, {"_id": 1, "video_id": 1, "thumbnail_url": 1}, batch_size):
+        for video in batch:
+            try:
+                content_type, data = decode_data_url(video["thumbnail_url"])
+            except ValueError as e:
+                print(f"  skip {video.get('video_id')}: {e}")
+                skipped += 1
+                continue
+
+            if dry_run:
+                migrated += 1
+                continue
+
+            try:
+                name = await store(content_type, data)
+            except Exception as e:
+                print(f"  skip {video.get('video_id')}: not stored ({e})")
+                skipped += 1
+                continue
+            # The data URL stays as a backup until --verify has seen every file
+            await db.videos.update_one(
+                {"_id": video["_id"], "thumbnail_url": video["thumbnail_url"]},
+                {"$set": {"thumbnail_url": thumbnail_store.url_for(name), "thumbnail_url_backup": video["thumbnail_url"]}}
+            )
+            migrated += 1
+
+        print(f"  progress: {migrated + skipped}/{total}")
+
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"{action} {migrated} thumbnails, skipped {skipped}")
+    if migrated and not dry_run:
+        print("Run again with --verify to drop the data-URL backups")
+
+async def verify(batch_size: int, dry_run: bool):
+    query = {"thumbnail_url_backup": {"$exists": True}}
+    total = await db.videos.count_documents(query)
+    print(f"Found {total} videos with data-URL backups")
+
+    verified = 0
+    repaired = 0
+    failed = 0
+    projection = {"_id": 1, "video_id": 1, "thumbnail_url": 1, "thumbnail_url_backup": 1}
+    async for batch in batches(query, projection, batch_size):
+        for video in batch:
+            name = (video.get("thumbnail_url") or "").rsplit("/", 1)[-1]
+            if thumbnail_store.path_for(name) is None:
+                print(f"  keep {video.get('video_id')}: thumbnail_url is not a stored thumbnail")
+                failed += 1
+                continue
+
+            missing = missing_files(name)
+            if not missing:
+                if not dry_run:
+                    await db.videos.update_one(
+                        {"_id": video["_id"], "thumbnail_url_backup": video["thumbnail_url_backup"]},
+                        {"$unset": {"thumbnail_url_backup": ""}}
+                    )
+                verified += 1
+                continue
+
+            print(f"  {video.get('video_id')}: missing {', '.join(missing)}")
+            if dry_run:
+                failed += 1
+                continue
+            try:
+                # Content-addressed, so the backup re-creates the same name
+                content_type, data = decode_data_url(video["thumbnail_url_backup"])
+                if await store(content_type, data) != name:
+                    raise ValueError("backup does not match the stored thumbnail")
+                repaired += 1
+            except Exception as e:
+                print(f"  keep {video.get('video_id')}: not repaired ({e})")
+                failed += 1
+
+        print(f"  progress: {verified + repaired + failed}/{total}")
+
+    action = "Would drop" if dry_run else "Dropped"
+    print(f"{action} {verified} backups; re-created files for {repaired} (backups kept), {failed} need attention")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--verify", action="store_true", help="drop backups whose files are all present")
+    args = parser.parse_args()
+    try:
+        asyncio.run((verify if args.verify else migrate)(args.batch_size, args.dry_run))
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    main()
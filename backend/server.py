@@ -1,95 +1,2569 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, UploadFile, File, Form, Query
 from fastapi.staticfiles import StaticFiles
+from fastapi.responses import FileResponse, ORJSONResponse
 from dotenv import load_dotenv
+import asyncio
 import base64
+import bisect
+import codecs
+import contextvars
+import csv
+import heapq
+import hmac
+import importlib.util
+import random
+import hashlib
+import io
+import json
+import math
+import multiprocessing
 import re
+import shutil
+import sys
+import tempfile
+import threading
 from starlette.middleware.cors import CORSMiddleware
+from starlette.routing import Match
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import List, Optional
 import uuid
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
 import httpx
+import orjson
+from PIL import Image, ImageOps
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+# Metrics, exposed in Prometheus text format at /metrics
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+class Histogram:
+    """Latency histogram per label set; safe to observe from Motor's worker threads"""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple, buckets: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self) -> List[str]:
+        with self._lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self._series.items()}
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bucket_names = self.label_names + ("le",)
+        for labels, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels(bucket_names, labels + (le,))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """Up/down gauge per label set"""
+
+    def __init__(self, name: str, documentation: str, label_names: tuple):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, labels: tuple, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, labels: tuple, amount: float = 1):
+        self.inc(labels, -amount)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{format_labels(self.label_names, labels)} {value}")
+        return lines
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+MONGO_LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Request latency by route template.",
+    ("method", "route", "status"), LATENCY_BUCKETS
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being served.", ("method", "route"))
+MONGO_COMMAND_SECONDS = Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency by collection and command.",
+    ("collection", "command", "outcome"), MONGO_LATENCY_BUCKETS
+)
+UPSTREAM_REQUEST_SECONDS = Histogram(
+    "upstream_request_duration_seconds", "Outbound call latency (auth provider, payment gateway).",
+    ("service", "operation", "outcome"), LATENCY_BUCKETS
+)
+METRICS = [HTTP_REQUEST_SECONDS, HTTP_REQUESTS_IN_FLIGHT, MONGO_COMMAND_SECONDS, UPSTREAM_REQUEST_SECONDS]
+
+def render_metrics() -> str:
+    return "\n".join(line for metric in METRICS for line in metric.render()) + "\n"
+
+class RequestProfile:
+    """Cost breakdown of one request, collected when REQUEST_PROFILING is on"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.mongo_calls = 0
+        self.mongo_seconds = 0.0
+        self.upstream_calls = 0
+        self.upstream_seconds = 0.0
+        self.response_bytes = 0
+        self.calls = []
+        # Mongo calls are recorded from Motor's worker threads
+        self._lock = threading.Lock()
+
+    def record_mongo(self, collection: str, command: str, seconds: float):
+        with self._lock:
+            self.mongo_calls += 1
+            self.mongo_seconds += seconds
+            self.calls.append(f"{collection}.{command} {seconds * 1000:.1f}ms")
+
+    def record_upstream(self, service: str, operation: str, seconds: float):
+        with self._lock:
+            self.upstream_calls += 1
+            self.upstream_seconds += seconds
+            self.calls.append(f"{service}.{operation} {seconds * 1000:.1f}ms")
+
+    def describe(self, elapsed: float) -> str:
+        python_seconds = max(0.0, elapsed - self.mongo_seconds - self.upstream_seconds)
+        return (
+            f"{elapsed * 1000:.1f}ms total, {self.mongo_calls} mongo calls {self.mongo_seconds * 1000:.1f}ms, "
+            f"{self.upstream_calls} upstream calls {self.upstream_seconds * 1000:.1f}ms, "
+            f"python {python_seconds * 1000:.1f}ms, {self.response_bytes} bytes sent: {', '.join(self.calls)}"
+        )
+
+# Motor copies the caller's context into its worker threads, so the command listener sees this too
+current_request_profile = contextvars.ContextVar("current_request_profile", default=None)
+
+def observe_upstream(service: str, operation: str, outcome: str, seconds: float):
+    UPSTREAM_REQUEST_SECONDS.observe((service, operation, outcome), seconds)
+    profile = current_request_profile.get()
+    if profile is not None:
+        profile.record_upstream(service, operation, seconds)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Feeds MONGO_COMMAND_SECONDS; pymongo calls it on Motor's worker threads"""
+
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        self._collections[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        self._finish(event, "ok")
+
+    def failed(self, event):
+        self._finish(event, "error")
+
+    def _finish(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        MONGO_COMMAND_SECONDS.observe((collection, event.command_name, outcome), event.duration_micros / 1e6)
+        profile = current_request_profile.get()
+        if profile is not None:
+            profile.record_mongo(collection, event.command_name, event.duration_micros / 1e6)
+
+mongo_command_listener = MongoCommandListener()
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# connect=False: nothing is opened until first use, which happens in each worker's lifespan
+# (safe when a process manager imports the app before forking workers)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, connect=False, event_listeners=[mongo_command_listener])
 db = client[os.environ['DB_NAME']]
 
-# Stripe integration
-from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+# Stripe integration
+from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
+
+ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'edric.yan2022@gmail.com')
+
+# Subscription pricing
+SUBSCRIPTION_PLANS = {
+    "free": {"price": 0.0, "name": "Free Plan", "features": ["Basic wrestling techniques", "Beginner tutorials"]},
+    "monthly": {"price": 19.99, "name": "Monthly Pro", "features": ["All basic techniques", "Secret techniques", "Advanced moves", "Priority support"]},
+    "annual": {"price": 149.99, "name": "Annual Pro", "features": ["All basic techniques", "Secret techniques", "Advanced moves", "Priority support", "2 months free"]}
+}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ensure_indexes()
+    await seed_video_order_counter()
+    await invalidation_bus.start()
+    await auth_client.start()
+    if session_signer is not None:
+        await session_revocations.start()
+    webhook_inbox.start()
+    subscription_sweeper.start()
+    watch_progress.start()
+    view_analytics.start()
+    yield
+    await view_analytics.stop()
+    await watch_progress.stop()
+    await subscription_sweeper.stop()
+    await session_revocations.stop()
+    await invalidation_bus.stop()
+    await webhook_inbox.stop()
+    await auth_client.close()
+    client.close()
+    if thumbnail_pool is not None:
+        thumbnail_pool.shutdown(wait=False, cancel_futures=True)
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+api_router = APIRouter(prefix="/api")
+
+# Pydantic Models
+class User(BaseModel):
+    user_id: str
+    email: str
+    name: str
+    picture: Optional[str] = None
+    subscription_plan: str = "free"
+    subscription_expires: Optional[datetime] = None
+    created_at: datetime
+
+class UserProfile(User):
+    created_at: Optional[datetime] = None
+    is_admin: bool = False
+
+class UserSession(BaseModel):
+    session_token: str
+    user_id: str
+    expires_at: datetime
+    created_at: datetime
+
+class Video(BaseModel):
+    video_id: str
+    title: str
+    description: str
+    category: str
+    video_url: str
+    thumbnail_url: Optional[str] = None
+    is_premium: bool = False
+    order: int = 0
+    created_at: datetime
+
+# Video reads skip the data-URL backup kept by migrate_thumbnails.py until verified
+VIDEO_PROJECTION = {"_id": 0, "thumbnail_url_backup": 0}
+
+class VideoListItem(Video):
+    is_locked: bool = False
+
+class ProgressHeartbeat(BaseModel):
+    position_seconds: float = Field(..., ge=0)
+    duration_seconds: Optional[float] = Field(None, gt=0)
+
+class ContinueWatchingItem(VideoListItem):
+    position_seconds: float
+    duration_seconds: Optional[float] = None
+    progress_updated_at: datetime
+
+class VideoSearchResponse(BaseModel):
+    results: List[VideoListItem]
+    suggestions: List[str]
+
+VIDEO_LIST_ADAPTER = TypeAdapter(List[VideoListItem])
+
+class VideoCreate(BaseModel):
+    title: str
+    description: str
+    category: str
+    video_url: str
+    thumbnail_url: Optional[str] = None
+    is_premium: bool = False
+
+class VideoOrder(BaseModel):
+    video_id: str
+    order: int
+
+class VideoReorder(BaseModel):
+    items: List[VideoOrder]
+
+YOUTUBE_ID_PATTERNS = [
+    re.compile(r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([^&\n?#]+)'),
+    re.compile(r'youtube\.com\/shorts\/([^&\n?#]+)'),
+]
+
+def extract_youtube_id(url: str) -> Optional[str]:
+    """Extract YouTube video ID from various URL formats"""
+    for pattern in YOUTUBE_ID_PATTERNS:
+        match = pattern.search(url)
+        if match:
+            return match.group(1)
+    return None
+
+def convert_to_embed_url(url: str) -> str:
+    """Convert any YouTube URL to embed format"""
+    video_id = extract_youtube_id(url)
+    if video_id:
+        return f"https://www.youtube.com/embed/{video_id}"
+    return url  # Return as-is if not a YouTube URL
+
+PREMIUM_PLANS = frozenset(["monthly", "annual"])
+
+def as_utc(value) -> Optional[datetime]:
+    """Normalize a stored timestamp to an aware UTC datetime.
+
+    New documents hold BSON dates; ISO strings are still accepted for rows
+    not yet converted by migrate_datetimes.py.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+def premium_status(user: Optional[dict]) -> str:
+    """Entitlement check: "active", "expired" or "free" (also used for anonymous users)"""
+    if not user:
+        return "free"
+    has_premium = user.get("has_premium")
+    if has_premium is False:
+        return "expired" if user.get("subscription_plan", "free") in PREMIUM_PLANS else "free"
+    if has_premium is None and user.get("subscription_plan", "free") not in PREMIUM_PLANS:
+        return "free"
+    # Flagged users are still checked against expiry until the next sweep downgrades them
+    expires = as_utc(user.get("subscription_expires"))
+    if expires is not None and expires < datetime.now(timezone.utc):
+        return "expired"
+    return "active"
+
+class SessionCache:
+    """Bounded LRU + TTL cache of session_token -> (user, session expiry)"""
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 60.0):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._tokens_by_user = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, session_token: str) -> Optional[dict]:
+        entry = self._entries.get(session_token)
+        if entry is None:
+            self.misses += 1
+            return None
+        user, session_expires, cached_until = entry
+        if time.monotonic() > cached_until or session_expires < datetime.now(timezone.utc):
+            self._remove(session_token)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_token)
+        self.hits += 1
+        return dict(user)
+
+    def set(self, session_token: str, user: dict, session_expires: datetime):
+        if session_token in self._entries:
+            self._remove(session_token)
+        self._entries[session_token] = (dict(user), session_expires, time.monotonic() + self.ttl_seconds)
+        self._tokens_by_user.setdefault(user["user_id"], set()).add(session_token)
+        while len(self._entries) > self.max_size:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def invalidate(self, session_token: str):
+        if session_token in self._entries:
+            self._remove(session_token)
+            self.invalidations += 1
+
+    def invalidate_user(self, user_id: str):
+        for session_token in list(self._tokens_by_user.get(user_id, ())):
+            self.invalidate(session_token)
+
+    def clear(self):
+        self._entries.clear()
+        self._tokens_by_user.clear()
+
+    def _remove(self, session_token: str):
+        user, _, _ = self._entries.pop(session_token)
+        tokens = self._tokens_by_user.get(user["user_id"])
+        if tokens is not None:
+            tokens.discard(session_token)
+            if not tokens:
+                del self._tokens_by_user[user["user_id"]]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations
+        }
+
+session_cache = SessionCache(
+    max_size=int(os.environ.get("SESSION_CACHE_MAX_SIZE", "10000")),
+    ttl_seconds=float(os.environ.get("SESSION_CACHE_TTL_SECONDS", "60"))
+)
+
+SESSION_LIFETIME = timedelta(days=7)
+
+class SessionSigner:
+    """HMAC-SHA256 signed session tokens carrying what get_current_user needs.
+
+    Format: "v1.<base64url JSON claims>.<base64url signature>". The claims hold
+    the database session token (sid), so a signed token can always fall back
+    to a normal session lookup.
+    """
+
+    PREFIX = "v1."
+
+    def __init__(self, secret: bytes):
+        self.secret = secret
+
+    @staticmethod
+    def _b64encode(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+    @staticmethod
+    def _b64decode(data: str) -> bytes:
+        return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+    def _sign(self, payload: str) -> str:
+        return self._b64encode(hmac.new(self.secret, payload.encode("ascii"), hashlib.sha256).digest())
+
+    def issue(self, session_token: str, user: dict, expires_at: datetime) -> str:
+        subscription_expires = as_utc(user.get("subscription_expires"))
+        created_at = as_utc(user.get("created_at"))
+        claims = {
+            "sid": session_token,
+            "uid": user["user_id"],
+            "email": user["email"],
+            "name": user.get("name"),
+            "pic": user.get("picture"),
+            "plan": user.get("subscription_plan", "free"),
+            "hp": user.get("has_premium"),
+            "sexp": subscription_expires.timestamp() if subscription_expires else None,
+            "cat": created_at.timestamp() if created_at else None,
+            "exp": expires_at.timestamp(),
+            "iat": time.time()
+        }
+        payload = self.PREFIX + self._b64encode(orjson.dumps(claims))
+        return f"{payload}.{self._sign(payload)}"
+
+    def verify(self, token: str) -> Optional[dict]:
+        """Claims of a well-signed, unexpired token; None otherwise"""
+        payload, _, signature = token.rpartition(".")
+        if not payload.startswith(self.PREFIX):
+            return None
+        try:
+            # Compare bytes: str compare_digest rejects non-ASCII input with TypeError
+            if not hmac.compare_digest(signature.encode("ascii"), self._sign(payload).encode("ascii")):
+                return None
+        except (UnicodeError, TypeError):
+            return None
+        try:
+            claims = orjson.loads(self._b64decode(payload[len(self.PREFIX):]))
+        except ValueError:
+            return None
+        if claims["exp"] < time.time():
+            return None
+        return claims
+
+    @staticmethod
+    def user_from_claims(claims: dict) -> dict:
+        def from_timestamp(value):
+            return datetime.fromtimestamp(value, timezone.utc) if value is not None else None
+        return {
+            "user_id": claims["uid"],
+            "email": claims["email"],
+            "name": claims["name"],
+            "picture": claims["pic"],
+            "subscription_plan": claims["plan"],
+            "has_premium": claims["hp"],
+            "subscription_expires": from_timestamp(claims["sexp"]),
+            "created_at": from_timestamp(claims["cat"])
+        }
+
+def build_session_signer() -> Optional[SessionSigner]:
+    if os.environ.get("SESSION_MODE", "database") != "signed":
+        return None
+    secret = os.environ.get("SESSION_SIGNING_KEY")
+    if not secret:
+        raise RuntimeError("SESSION_SIGNING_KEY is required when SESSION_MODE=signed")
+    return SessionSigner(secret.encode("utf-8"))
+
+session_signer = build_session_signer()
+
+class BackgroundLoop:
+    """Runs `copies` instances of a long-lived coroutine between start() and stop()"""
+
+    def __init__(self, target, copies: int = 1):
+        self.target = target
+        self.copies = copies
+        self._tasks = []
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self.target()) for _ in range(self.copies)]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+class SessionRevocations:
+    """In-memory denylist for signed session tokens, shared through `session_revocations`.
+
+    A session entry rejects its token outright (logout). A user entry sends
+    that user's tokens issued before it back to the database lookup (new
+    login, subscription change), which re-reads the current entitlement.
+    Every worker polls the collection, so revocations spread within one
+    refresh interval.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self.sessions = {}
+        self.users = {}
+        self._seen_until = None
+        self._loop = BackgroundLoop(self._run)
+        self.refreshes = 0
+
+    def session_revoked(self, session_token: str) -> bool:
+        return session_token in self.sessions
+
+    def user_revoked_since(self, user_id: str, issued_at: float) -> bool:
+        revoked_at = self.users.get(user_id)
+        return revoked_at is not None and revoked_at >= issued_at
+
+    async def revoke_session(self, session_token: str):
+        await self._record([{"kind": "session", "key": session_token}])
+
+    async def revoke_users(self, user_ids):
+        await self._record([{"kind": "user", "key": user_id} for user_id in user_ids])
+
+    async def _record(self, entries: list):
+        if not entries:
+            return
+        now = datetime.now(timezone.utc)
+        docs = [{**entry, "revoked_at": now, "expires_at": now + SESSION_LIFETIME} for entry in entries]
+        # Apply locally first so this worker never honours a revoked token
+        self._apply(docs)
+        await db.session_revocations.insert_many(docs, ordered=False)
+
+    def _apply(self, docs: list):
+        for doc in docs:
+            if doc["kind"] == "session":
+                self.sessions[doc["key"]] = as_utc(doc["expires_at"])
+            else:
+                revoked_at = as_utc(doc["revoked_at"]).timestamp()
+                self.users[doc["key"]] = max(revoked_at, self.users.get(doc["key"], 0.0))
+
+    async def refresh(self):
+        now = datetime.now(timezone.utc)
+        query = {"expires_at": {"$gt": now}}
+        if self._seen_until is not None:
+            # Overlap the previous window; writes can commit slightly out of timestamp order
+            query["revoked_at"] = {"$gte": self._seen_until - timedelta(seconds=self.refresh_seconds)}
+        docs = await db.session_revocations.find(query, {"_id": 0}).to_list(None)
+        self._apply(docs)
+        self._seen_until = now
+        
+        # Tokens older than the session lifetime have expired anyway
+        horizon = (now - SESSION_LIFETIME).timestamp()
+        self.sessions = {key: expires for key, expires in self.sessions.items() if expires > now}
+        self.users = {key: revoked_at for key, revoked_at in self.users.items() if revoked_at > horizon}
+        self.refreshes += 1
+
+    async def start(self):
+        if not self._loop.running:
+            await self.refresh()
+            self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logging.error(f"Session revocation refresh failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "users": len(self.users),
+            "refreshes": self.refreshes
+        }
+
+session_revocations = SessionRevocations(
+    refresh_seconds=float(os.environ.get("SESSION_REVOCATION_REFRESH_SECONDS", "5"))
+)
+
+async def invalidate_user_sessions(user_ids):
+    """Drop cached sessions of users whose entitlement or sessions changed, in every worker"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return
+    for user_id in user_ids:
+        session_cache.invalidate_user(user_id)
+    if session_signer is not None:
+        await session_revocations.revoke_users(user_ids)
+    await invalidation_bus.publish("users", user_ids)
+
+# Index definitions, created idempotently at startup
+INDEX_SPECS = {
+    "users": [
+        IndexModel([("email", ASCENDING)], name="email_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+        IndexModel([("has_premium", ASCENDING), ("subscription_expires", ASCENDING)], name="has_premium_subscription_expires"),
+    ],
+    "user_sessions": [
+        IndexModel([("session_token", ASCENDING)], name="session_token_unique", unique=True),
+        IndexModel([("user_id", ASCENDING)], name="user_id"),
+        # Sessions are removed by Mongo once expires_at (a BSON date) has passed
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "videos": [
+        IndexModel([("video_id", ASCENDING)], name="video_id_unique", unique=True),
+        IndexModel([("order", ASCENDING), ("video_id", ASCENDING)], name="order_video_id"),
+        IndexModel([("category", ASCENDING), ("order", ASCENDING), ("video_id", ASCENDING)], name="category_order_video_id"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_id_created_at"),
+    ],
+    "session_revocations": [
+        IndexModel([("revoked_at", ASCENDING)], name="revoked_at"),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "watch_progress": [
+        IndexModel([("user_id", ASCENDING), ("video_id", ASCENDING)], name="user_id_video_id_unique", unique=True),
+        # "Continue watching": a user's unfinished videos, most recent first
+        IndexModel([("user_id", ASCENDING), ("completed", ASCENDING), ("updated_at", DESCENDING)], name="user_id_completed_updated_at"),
+    ],
+    "video_view_rollups": [
+        IndexModel([("granularity", ASCENDING), ("bucket", ASCENDING), ("video_id", ASCENDING)], name="granularity_bucket_video_id_unique", unique=True),
+        IndexModel([("granularity", ASCENDING), ("category", ASCENDING), ("bucket", ASCENDING)], name="granularity_category_bucket"),
+        # Only hourly rollups carry expires_at
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "webhook_events": [
+        IndexModel([("status", ASCENDING), ("next_attempt_at", ASCENDING)], name="status_next_attempt_at"),
+    ],
+}
+
+async def ensure_indexes():
+    """Create all indexes in INDEX_SPECS, skipping (and logging) any that conflict"""
+    for collection_name, indexes in INDEX_SPECS.items():
+        for index in indexes:
+            try:
+                await db[collection_name].create_indexes([index])
+            except OperationFailure as e:
+                logging.error(f"Could not create index {index.document['name']} on {collection_name}: {e}")
+
+async def get_index_stats() -> dict:
+    """Report per-index usage counters via $indexStats"""
+    stats = {}
+    for collection_name in INDEX_SPECS:
+        try:
+            rows = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        except OperationFailure as e:
+            stats[collection_name] = {"error": str(e)}
+            continue
+        stats[collection_name] = {
+            row["name"]: {
+                "ops": row.get("accesses", {}).get("ops", 0),
+                "since": row.get("accesses", {}).get("since")
+            }
+            for row in rows
+        }
+    return stats
+
+class CatalogSnapshot:
+    """In-memory copy of the video catalog, rebuilt only after the catalog changes"""
+
+    def __init__(self):
+        self.version = 0
+        self.videos = []
+        self.by_id = {}
+        self.free_view = []
+        self.premium_view = []
+        self.free_etag = None
+        self.premium_etag = None
+        self.free_json = b"[]"
+        self.premium_json = b"[]"
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    async def get(self) -> "CatalogSnapshot":
+        if self._stale:
+            async with self._lock:
+                if self._stale:
+                    await self._rebuild()
+        return self
+
+    async def _rebuild(self):
+        # Clear the flag first so a write landing mid-rebuild triggers another one
+        self._stale = False
+        videos = await db.videos.find({}, VIDEO_PROJECTION).sort("order", 1).to_list(None)
+        self.videos = videos
+        self.by_id = {video["video_id"]: video for video in videos}
+        self.free_view = [{**video, "is_locked": video.get("is_premium", False)} for video in videos]
+        self.premium_view = [{**video, "is_locked": False} for video in videos]
+        # Serialize once per rebuild; requests send these bytes as-is
+        self.free_json = VIDEO_LIST_ADAPTER.dump_json(VIDEO_LIST_ADAPTER.validate_python(self.free_view))
+        self.premium_json = VIDEO_LIST_ADAPTER.dump_json(VIDEO_LIST_ADAPTER.validate_python(self.premium_view))
+        self.free_etag = self._etag(self.free_json)
+        self.premium_etag = self._etag(self.premium_json)
+        self.version += 1
+
+    @staticmethod
+    def _etag(body: bytes) -> str:
+        return f'W/"{hashlib.sha1(body).hexdigest()[:20]}"'
+
+    def view_for(self, has_premium: bool):
+        if has_premium:
+            return self.premium_view, self.premium_etag
+        return self.free_view, self.free_etag
+
+    def json_for(self, has_premium: bool):
+        if has_premium:
+            return self.premium_json, self.premium_etag
+        return self.free_json, self.free_etag
+
+catalog = CatalogSnapshot()
+
+VIDEO_PAGE_DEFAULT_LIMIT = 50
+VIDEO_PAGE_MAX_LIMIT = 200
+
+def encode_video_cursor(video: dict) -> str:
+    """Build an opaque cursor pointing just past the given video"""
+    payload = json.dumps({"o": video.get("order", 0), "v": video["video_id"]}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_video_cursor(cursor: str) -> dict:
+    """Decode a cursor from encode_video_cursor into (order, video_id)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return {"order": int(payload["o"]), "video_id": str(payload["v"])}
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+async def fetch_video_page(category: Optional[str], limit: int, cursor: Optional[str]):
+    """Read one page of videos in (order, video_id) order, served by the order/category indexes"""
+    query = {}
+    if category:
+        query["category"] = category
+    if cursor:
+        position = decode_video_cursor(cursor)
+        query["$or"] = [
+            {"order": {"$gt": position["order"]}},
+            {"order": position["order"], "video_id": {"$gt": position["video_id"]}}
+        ]
+    
+    videos = await db.videos.find(query, VIDEO_PROJECTION).sort(
+        [("order", ASCENDING), ("video_id", ASCENDING)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    next_cursor = None
+    if len(videos) > limit:
+        videos = videos[:limit]
+        next_cursor = encode_video_cursor(videos[-1])
+    return videos, next_cursor
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Check an If-None-Match header against an ETag"""
+    if_none_match = request.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates
+
+class ThumbnailStore:
+    """Content-addressed thumbnail storage on local disk.
+
+    Files are named by the SHA-256 of their bytes, so identical uploads share
+    one file and a stored URL never changes meaning.
+    """
+
+    CHUNK_SIZE = 64 * 1024
+    EXTENSIONS = {
+        "image/jpeg": "jpg",
+        "image/png": "png",
+        "image/gif": "gif",
+        "image/webp": "webp"
+    }
+    NAME_PATTERN = re.compile(r'^([0-9a-f]{64})(?:-(\d{2,4}))?\.(jpg|png|gif|webp)$')
+    VARIANT_WIDTHS = (320, 640, 1280)
+    VARIANT_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    def path_for(self, name: str) -> Optional[Path]:
+        match = self.NAME_PATTERN.match(name)
+        if not match:
+            return None
+        return self.root / match.group(1)[:2] / name
+
+    @staticmethod
+    def url_for(name: str) -> str:
+        return f"/api/thumbnails/{name}"
+
+    @staticmethod
+    def variant_name(name: str, width: int, extension: str) -> str:
+        return f"{name.split('.')[0].split('-')[0]}-{width}.{extension}"
+
+    def pick_variant(self, name: str, width: Optional[int], accepts_webp: bool) -> str:
+        """Pick the smallest stored variant at least `width` wide, falling back to the original"""
+        widths = [w for w in self.VARIANT_WIDTHS if width is None or w >= width] or [self.VARIANT_WIDTHS[-1]]
+        extension = "webp" if accepts_webp else "jpg"
+        for candidate_width in widths:
+            candidate = self.variant_name(name, candidate_width, extension)
+            if self.path_for(candidate).is_file():
+                return candidate
+        return name
+
+    def save_stream(self, source, content_type: str) -> str:
+        """Copy a binary file object into the store in chunks; returns the stored name.
+
+        Blocking - call from a worker thread.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=self.root, prefix=".upload-", delete=False) as tmp:
+            try:
+                while True:
+                    chunk = source.read(self.CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    size += len(chunk)
+                    if size > self.max_bytes:
+                        raise ValueError("Thumbnail too large")
+                    digest.update(chunk)
+                    tmp.write(chunk)
+            except BaseException:
+                tmp.close()
+                os.unlink(tmp.name)
+                raise
+        
+        name = f"{digest.hexdigest()}.{self.EXTENSIONS[content_type]}"
+        target = self.path_for(name)
+        if target.exists():
+            os.unlink(tmp.name)
+        else:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(tmp.name, target)
+        return name
+
+    def save_bytes(self, data: bytes, content_type: str) -> str:
+        """Store an in-memory image (used when migrating data URLs)"""
+        return self.save_stream(io.BytesIO(data), content_type)
+
+def render_thumbnail_variants(source_path: str, widths: tuple, quality: int) -> List[str]:
+    """Write resized WebP and JPEG variants next to a stored original.
+
+    CPU-bound - runs in the thumbnail process pool, never on the event loop.
+    """
+    source = Path(source_path)
+    digest = source.name.split(".")[0]
+    written = []
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        image = image.convert("RGB")
+        for width in widths:
+            if width < image.width:
+                height = max(1, round(image.height * width / image.width))
+                resized = image.resize((width, height), Image.Resampling.LANCZOS)
+            else:
+                resized = image
+            for extension, image_format in ThumbnailStore.VARIANT_FORMATS.items():
+                name = f"{digest}-{width}.{extension}"
+                target = source.parent / name
+                if not target.exists():
+                    tmp_path = source.parent / f".{name}.tmp"
+                    resized.save(tmp_path, image_format, quality=quality, optimize=True)
+                    os.replace(tmp_path, target)
+                written.append(name)
+    return written
+
+thumbnail_pool = None
+
+def get_thumbnail_pool() -> ProcessPoolExecutor:
+    global thumbnail_pool
+    if thumbnail_pool is None:
+        # Forking a process that already runs an event loop and Mongo client threads
+        # can copy held locks into the child; start workers from a clean process
+        start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        thumbnail_pool = ProcessPoolExecutor(
+            max_workers=int(os.environ.get("THUMBNAIL_WORKERS", str(min(2, os.cpu_count() or 1)))),
+            mp_context=multiprocessing.get_context(start_method)
+        )
+    return thumbnail_pool
+
+# Required: point it at persistent storage (a mounted volume), never the container's
+# own filesystem - migrated thumbnails have no other copy once verified
+thumbnail_store = ThumbnailStore(
+    root=Path(os.environ['THUMBNAIL_DIR']),
+    max_bytes=int(os.environ.get("THUMBNAIL_MAX_BYTES", str(10 * 1024 * 1024)))
+)
+
+class AuthClient:
+    """App-lifetime pooled HTTP client for the OAuth session-data exchange"""
+
+    RETRYABLE_STATUS = {502, 503, 504}
+
+    def __init__(self, base_url: str, max_retries: int = 2, backoff_base: float = 0.1):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.http = None
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.total_seconds = 0.0
+
+    async def start(self):
+        if self.http is not None:
+            return
+        self.http = httpx.AsyncClient(
+            base_url=self.base_url,
+            http2=importlib.util.find_spec("h2") is not None,
+            limits=httpx.Limits(
+                max_connections=int(os.environ.get("AUTH_HTTP_MAX_CONNECTIONS", "50")),
+                max_keepalive_connections=int(os.environ.get("AUTH_HTTP_MAX_KEEPALIVE", "20")),
+                keepalive_expiry=30.0
+            ),
+            timeout=httpx.Timeout(
+                float(os.environ.get("AUTH_HTTP_TIMEOUT_SECONDS", "10")),
+                connect=float(os.environ.get("AUTH_HTTP_CONNECT_TIMEOUT_SECONDS", "3"))
+            )
+        )
+
+    async def close(self):
+        if self.http is not None:
+            await self.http.aclose()
+            self.http = None
+
+    async def get_session_data(self, session_id: str) -> Optional[dict]:
+        """Exchange an OAuth session_id for user data; None if the provider rejects it"""
+        if self.http is None:
+            await self.start()
+        attempt = 0
+        while True:
+            self.requests += 1
+            self.in_flight += 1
+            started = time.perf_counter()
+            try:
+                auth_response = await self.http.get(
+                    "/auth/v1/env/oauth/session-data",
+                    headers={"X-Session-ID": session_id}
+                )
+            except httpx.TransportError:
+                auth_response = None
+            finally:
+                self.in_flight -= 1
+                elapsed = time.perf_counter() - started
+                self.total_seconds += elapsed
+            observe_upstream(
+                "auth", "session_data",
+                str(auth_response.status_code) if auth_response is not None else "transport_error",
+                elapsed
+            )
+            
+            retryable = auth_response is None or auth_response.status_code in self.RETRYABLE_STATUS
+            if retryable and attempt < self.max_retries:
+                attempt += 1
+                self.retries += 1
+                # Exponential backoff with full jitter
+                await asyncio.sleep(random.uniform(0, self.backoff_base * (2 ** attempt)))
+                continue
+            if auth_response is None:
+                self.errors += 1
+                raise HTTPException(status_code=503, detail="Auth provider unavailable")
+            if auth_response.status_code != 200:
+                self.errors += 1
+                return None
+            return auth_response.json()
+
+    def stats(self) -> dict:
+        pool_connections = None
+        try:
+            # httpcore does not expose pool metrics publicly
+            pool_connections = len(self.http._transport._pool.connections)
+        except AttributeError:
+            pass
+        return {
+            "base_url": self.base_url,
+            "requests": self.requests,
+            "retries": self.retries,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "avg_ms": (self.total_seconds / self.requests * 1000) if self.requests else 0.0,
+            "pool_connections": pool_connections
+        }
+
+auth_client = AuthClient(
+    base_url=os.environ.get("AUTH_BASE_URL", "https://demobackend.emergentagent.com"),
+    max_retries=int(os.environ.get("AUTH_HTTP_MAX_RETRIES", "2"))
+)
+
+class PaymentWebhookEvent(BaseModel):
+    event_type: str
+    event_id: str
+    session_id: str
+    payment_status: str
+    metadata: dict = {}
+
+class PaymentGateway:
+    """Checkout provider interface, with per-operation latency instrumentation"""
+
+    name = "base"
+
+    def __init__(self):
+        self.metrics = {}
+
+    def bind_base_url(self, base_url: str):
+        """Called with each request's base URL; providers needing a webhook URL read it per request"""
+
+    async def create_checkout_session(self, checkout_request: CheckoutSessionRequest) -> CheckoutSessionResponse:
+        return await self._timed("create_checkout_session", self._create_checkout_session(checkout_request))
+
+    async def get_checkout_status(self, session_id: str) -> CheckoutStatusResponse:
+        return await self._timed("get_checkout_status", self._get_checkout_status(session_id))
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        return await self._timed("handle_webhook", self._handle_webhook(body, signature))
+
+    async def _create_checkout_session(self, checkout_request):
+        raise NotImplementedError
+
+    async def _get_checkout_status(self, session_id):
+        raise NotImplementedError
+
+    async def _handle_webhook(self, body, signature):
+        raise NotImplementedError
+
+    async def _timed(self, operation: str, coro):
+        metric = self.metrics.setdefault(operation, {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0})
+        outcome = "ok"
+        started = time.perf_counter()
+        try:
+            return await coro
+        except Exception:
+            metric["errors"] += 1
+            outcome = "error"
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            metric["calls"] += 1
+            metric["total_ms"] += elapsed * 1000
+            metric["max_ms"] = max(metric["max_ms"], elapsed * 1000)
+            observe_upstream(f"payments_{self.name}", operation, outcome, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "gateway": self.name,
+            "operations": {
+                operation: {**metric, "avg_ms": metric["total_ms"] / metric["calls"] if metric["calls"] else 0.0}
+                for operation, metric in self.metrics.items()
+            }
+        }
+
+class StripePaymentGateway(PaymentGateway):
+    """Stripe via one StripeCheckout instance reused across requests.
+
+    The webhook URL comes from configuration (see build_payment_gateway).
+    Without one, it falls back to the current request's base URL and builds
+    an instance per call, since the Host header is client-supplied.
+    """
+
+    name = "stripe"
+
+    def __init__(self, api_key: Optional[str], webhook_url: Optional[str] = None):
+        super().__init__()
+        self.api_key = api_key
+        self.webhook_url = webhook_url
+        self._checkout = None
+        self._base_url = contextvars.ContextVar("stripe_base_url", default="")
+
+    def bind_base_url(self, base_url: str):
+        self._base_url.set(base_url)
+
+    def _stripe(self) -> StripeCheckout:
+        if self.webhook_url is None:
+            return StripeCheckout(api_key=self.api_key, webhook_url=f"{self._base_url.get()}api/webhook/stripe")
+        if self._checkout is None:
+            self._checkout = StripeCheckout(api_key=self.api_key, webhook_url=self.webhook_url)
+        return self._checkout
+
+    async def _create_checkout_session(self, checkout_request):
+        return await self._stripe().create_checkout_session(checkout_request)
+
+    async def _get_checkout_status(self, session_id):
+        return await self._stripe().get_checkout_status(session_id)
+
+    async def _handle_webhook(self, body, signature):
+        return await self._stripe().handle_webhook(body, signature)
+
+class FakePaymentGateway(PaymentGateway):
+    """In-memory gateway for local runs and load tests; no network access.
+
+    Sessions report paid after `paid_after_polls` status checks. Webhook bodies
+    are plain JSON: {"session_id": ..., "payment_status": ..., "metadata": {...}}.
+    """
+
+    name = "fake"
+
+    def __init__(self, paid_after_polls: int = 1, latency_seconds: float = 0.0):
+        super().__init__()
+        self.paid_after_polls = paid_after_polls
+        self.latency_seconds = latency_seconds
+        self.sessions = {}
+
+    async def _create_checkout_session(self, checkout_request):
+        await asyncio.sleep(self.latency_seconds)
+        session_id = f"cs_fake_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {"request": checkout_request, "polls": 0}
+        return CheckoutSessionResponse(
+            url=checkout_request.success_url.replace("{CHECKOUT_SESSION_ID}", session_id),
+            session_id=session_id
+        )
+
+    async def _get_checkout_status(self, session_id):
+        await asyncio.sleep(self.latency_seconds)
+        session = self.sessions.setdefault(session_id, {"request": None, "polls": 0})
+        session["polls"] += 1
+        paid = session["polls"] >= self.paid_after_polls
+        checkout_request = session["request"]
+        return CheckoutStatusResponse(
+            status="complete" if paid else "open",
+            payment_status="paid" if paid else "unpaid",
+            amount_total=int(round(checkout_request.amount * 100)) if checkout_request else 0,
+            currency=checkout_request.currency if checkout_request else "usd",
+            metadata=(checkout_request.metadata or {}) if checkout_request else {}
+        )
+
+    async def _handle_webhook(self, body, signature):
+        payload = json.loads(body)
+        return PaymentWebhookEvent(
+            event_type=payload.get("event_type", "checkout.session.completed"),
+            event_id=payload.get("event_id", f"evt_fake_{uuid.uuid4().hex}"),
+            session_id=payload["session_id"],
+            payment_status=payload.get("payment_status", "paid"),
+            metadata=payload.get("metadata", {})
+        )
+
+def build_payment_gateway() -> PaymentGateway:
+    if os.environ.get("PAYMENT_GATEWAY", "stripe") == "fake":
+        return FakePaymentGateway(
+            paid_after_polls=int(os.environ.get("FAKE_PAYMENT_PAID_AFTER_POLLS", "1")),
+            latency_seconds=float(os.environ.get("FAKE_PAYMENT_LATENCY_SECONDS", "0"))
+        )
+    webhook_url = os.environ.get("STRIPE_WEBHOOK_URL")
+    if not webhook_url and os.environ.get("BACKEND_URL"):
+        webhook_url = f"{os.environ['BACKEND_URL'].rstrip('/')}/api/webhook/stripe"
+    if not webhook_url:
+        logging.error(
+            "Neither STRIPE_WEBHOOK_URL nor BACKEND_URL is set: Stripe webhook URLs will be taken "
+            "from each request's Host header and a StripeCheckout built per call. Set one of them."
+        )
+    return StripePaymentGateway(api_key=os.environ.get("STRIPE_API_KEY"), webhook_url=webhook_url)
+
+payment_gateway = build_payment_gateway()
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens/second up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self, tokens: float = 1.0) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+        return False
+
+    def retry_after(self, tokens: float = 1.0) -> float:
+        """Seconds until `tokens` will be available"""
+        return max(0.0, (tokens - self.tokens) / self.rate) if self.rate else float("inf")
+
+class RateLimiter:
+    """Per-client token buckets for the routes that call external services.
+
+    Each request is charged against a bucket for its client IP and, when it
+    carries one, its session token; both must have a token left. Buckets are
+    kept in a bounded LRU.
+    """
+
+    def __init__(self, budgets: dict, proxy_hops: int, max_buckets: int = 100000):
+        self.budgets = budgets
+        self.proxy_hops = proxy_hops
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()
+        self.allowed = {}
+        self.limited = {}
+
+    def client_ip(self, request: Request) -> str:
+        """Client address; with proxy_hops set, read from X-Forwarded-For as written by our own proxies"""
+        if self.proxy_hops:
+            forwarded = [part.strip() for part in request.headers.get("X-Forwarded-For", "").split(",") if part.strip()]
+            if len(forwarded) >= self.proxy_hops:
+                return forwarded[-self.proxy_hops]
+        return request.client.host if request.client else "unknown"
+
+    def _bucket(self, key: tuple, rate: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate=rate, capacity=burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def check(self, request: Request, route: str):
+        """Raise 429 with Retry-After when this client is over the route's budget"""
+        rate, burst = self.budgets[route]
+        buckets = [self._bucket((route, "ip", self.client_ip(request)), rate, burst)]
+        session_token = request_session_token(request)
+        if session_token:
+            buckets.append(self._bucket((route, "session", session_token), rate, burst))
+        
+        # Take from every bucket or none, so a rejected request costs nothing
+        for bucket in buckets:
+            bucket.try_acquire(0)
+        if any(bucket.tokens < 1 for bucket in buckets):
+            self.limited[route] = self.limited.get(route, 0) + 1
+            retry_after = max(bucket.retry_after() for bucket in buckets)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+            )
+        for bucket in buckets:
+            bucket.try_acquire()
+        self.allowed[route] = self.allowed.get(route, 0) + 1
+
+    def stats(self) -> dict:
+        return {
+            "budgets": {route: {"rate": rate, "burst": burst} for route, (rate, burst) in self.budgets.items()},
+            "buckets": len(self._buckets),
+            "allowed": self.allowed,
+            "limited": self.limited
+        }
+
+def rate_budget(name: str, default: str):
+    """"rate per second,burst" from the environment"""
+    rate, burst = os.environ.get(name, default).split(",")
+    return float(rate), float(burst)
+
+rate_limiter = RateLimiter(
+    budgets={
+        "login": rate_budget("RATE_LIMIT_LOGIN", "0.2,5"),
+        "checkout": rate_budget("RATE_LIMIT_CHECKOUT", "0.1,3"),
+        "payment_status": rate_budget("RATE_LIMIT_PAYMENT_STATUS", "1,5")
+    },
+    # The app is served behind one ingress proxy, which appends the real client
+    # address to X-Forwarded-For; without it every user would share the proxy's
+    # bucket. Set 0 when clients connect directly, more when proxies are chained.
+    proxy_hops=int(os.environ.get("RATE_LIMIT_PROXY_HOPS", "1"))
+)
+
+class UpstreamBulkhead:
+    """Caps concurrent calls to one external service.
+
+    A request waits at most `max_wait` seconds for a slot, then gets a 503,
+    so a slow provider ties up a bounded number of sockets and tasks.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_wait: float):
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self.in_flight = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail=f"{self.name} is busy, try again shortly",
+                headers={"Retry-After": "1"}
+            )
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected
+        }
+
+auth_bulkhead = UpstreamBulkhead(
+    "Auth provider",
+    max_concurrent=int(os.environ.get("AUTH_MAX_CONCURRENT", "20")),
+    max_wait=float(os.environ.get("UPSTREAM_MAX_WAIT_SECONDS", "0.5"))
+)
+payments_bulkhead = UpstreamBulkhead(
+    "Payment provider",
+    max_concurrent=int(os.environ.get("PAYMENTS_MAX_CONCURRENT", "20")),
+    max_wait=float(os.environ.get("UPSTREAM_MAX_WAIT_SECONDS", "0.5"))
+)
+
+class PaymentStatusPoller:
+    """Coalesces and caches checkout-status lookups against the payment gateway.
+
+    Concurrent polls for one session share a single upstream call, results are
+    reused for a short window (longer once terminal), and upstream calls are
+    capped per second. When the cap is hit, the last known result (or a
+    pending placeholder) is returned so clients simply poll again.
+    """
+
+    TERMINAL_STATUSES = {"complete", "expired"}
+
+    def __init__(self, ttl_seconds: float, terminal_ttl_seconds: float, max_per_second: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.terminal_ttl_seconds = terminal_ttl_seconds
+        self.limiter = TokenBucket(rate=max_per_second, capacity=max_per_second)
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self._in_flight = {}
+        self.upstream_calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+        self.throttled = 0
+
+    async def get(self, session_id: str) -> CheckoutStatusResponse:
+        cached = self._results.get(session_id)
+        if cached is not None and time.monotonic() < cached[1]:
+            self.cache_hits += 1
+            return cached[0]
+        
+        in_flight = self._in_flight.get(session_id)
+        if in_flight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(in_flight)
+        
+        if not self.limiter.try_acquire():
+            self.throttled += 1
+            if cached is not None:
+                return cached[0]
+            return CheckoutStatusResponse(status="open", payment_status="unpaid", amount_total=0, currency="usd", metadata={})
+        
+        task = asyncio.ensure_future(self._fetch_with_slot(session_id))
+        self._in_flight[session_id] = task
+        try:
+            return await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._in_flight.pop(session_id, None)
+            else:
+                task.add_done_callback(lambda _: self._in_flight.pop(session_id, None))
+
+    async def _fetch_with_slot(self, session_id: str) -> CheckoutStatusResponse:
+        async with payments_bulkhead.slot():
+            return await self._fetch(session_id)
+
+    async def _fetch(self, session_id: str) -> CheckoutStatusResponse:
+        self.upstream_calls += 1
+        status = await payment_gateway.get_checkout_status(session_id)
+        ttl = self.terminal_ttl_seconds if status.status in self.TERMINAL_STATUSES else self.ttl_seconds
+        self._results[session_id] = (status, time.monotonic() + ttl)
+        self._results.move_to_end(session_id)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+        return status
+
+    def stats(self) -> dict:
+        return {
+            "upstream_calls": self.upstream_calls,
+            "cache_hits": self.cache_hits,
+            "coalesced": self.coalesced,
+            "throttled": self.throttled,
+            "in_flight": len(self._in_flight),
+            "cached": len(self._results)
+        }
+
+payment_status_poller = PaymentStatusPoller(
+    ttl_seconds=float(os.environ.get("PAYMENT_STATUS_CACHE_SECONDS", "2")),
+    terminal_ttl_seconds=float(os.environ.get("PAYMENT_STATUS_TERMINAL_CACHE_SECONDS", "600")),
+    max_per_second=float(os.environ.get("PAYMENT_STATUS_MAX_UPSTREAM_PER_SECOND", "20"))
+)
+
+def subscription_expiry(plan: str) -> datetime:
+    if plan == "monthly":
+        return datetime.now(timezone.utc) + timedelta(days=30)
+    return datetime.now(timezone.utc) + timedelta(days=365)
+
+def paid_subscription_update(session_id: str, user_id: str, plan: str):
+    """(filter, update) granting `plan` to a user for a paid checkout session.
+
+    The filter skips users already upgraded by this session, so the status
+    poll and the webhook can both apply it without extending twice.
+    """
+    return (
+        {"user_id": user_id, "subscription_session_id": {"$ne": session_id}},
+        {"$set": {
+            "subscription_plan": plan,
+            "subscription_expires": subscription_expiry(plan),
+            "subscription_session_id": session_id,
+            "has_premium": True
+        }}
+    )
+
+TRANSACTION_PAID_UPDATE = {"$set": {"status": "complete", "payment_status": "paid"}}
+
+class WebhookInbox:
+    """Durable inbox for payment webhooks.
+
+    Events are stored in `webhook_events` (keyed by event id, so redeliveries
+    are dropped) and acknowledged at once; background workers claim due
+    events in batches, apply them with bulk writes and retry failures with
+    exponential backoff.
+    """
+
+    def __init__(self, workers: int, batch_size: int, poll_interval: float, max_attempts: int,
+                 backoff_base: float = 2.0, lock_seconds: float = 60.0):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.lock_seconds = lock_seconds
+        self._workers = BackgroundLoop(self._worker, copies=workers)
+        self._wakeup = asyncio.Event()
+        self.received = 0
+        self.duplicates = 0
+        self.processed = 0
+        self.failed = 0
+
+    async def enqueue(self, event) -> bool:
+        """Persist a verified event; returns False for a duplicate delivery"""
+        now = datetime.now(timezone.utc)
+        doc = {
+            "_id": getattr(event, "event_id", None) or f"evt_{uuid.uuid4().hex}",
+            "event_type": getattr(event, "event_type", None),
+            "session_id": event.session_id,
+            "payment_status": event.payment_status,
+            "metadata": dict(event.metadata or {}),
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "received_at": now
+        }
+        try:
+            await db.webhook_events.insert_one(doc)
+        except DuplicateKeyError:
+            self.duplicates += 1
+            return False
+        self.received += 1
+        self._wakeup.set()
+        return True
+
+    def start(self):
+        self._workers.start()
+
+    async def stop(self):
+        await self._workers.stop()
+
+    async def _claim_batch(self) -> list:
+        """Claim up to batch_size due events in three round trips instead of one per event"""
+        now = datetime.now(timezone.utc)
+        due = {"$or": [
+            {"status": {"$in": ["pending", "failed"]}, "next_attempt_at": {"$lte": now}},
+            {"status": "processing", "locked_until": {"$lte": now}}
+        ]}
+        ids = [
+            doc["_id"]
+            async for doc in db.webhook_events.find(due, {"_id": 1}).sort("next_attempt_at", ASCENDING).limit(self.batch_size)
+        ]
+        if not ids:
+            return []
+        # Re-checking `due` per document lets only one worker claim each event;
+        # the claim id then tells this worker which of them it won
+        claim_id = uuid.uuid4().hex
+        await db.webhook_events.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": "processing", "locked_until": now + timedelta(seconds=self.lock_seconds), "claim_id": claim_id}}
+        )
+        return await db.webhook_events.find(
+            {"_id": {"$in": ids}, "claim_id": claim_id}
+        ).sort("next_attempt_at", ASCENDING).to_list(None)
+
+    async def _worker(self):
+        while True:
+            try:
+                batch = await self._claim_batch()
+                if batch:
+                    await self._process(batch)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Webhook inbox worker error: {e}")
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _process(self, batch: list):
+        paid_events = [event for event in batch if event["payment_status"] == "paid"]
+        try:
+            transactions = {}
+            if paid_events:
+                rows = await db.payment_transactions.find(
+                    {"session_id": {"$in": [event["session_id"] for event in paid_events]}},
+                    {"_id": 0, "session_id": 1, "payment_status": 1}
+                ).to_list(None)
+                transactions = {row["session_id"]: row for row in rows}
+            
+            user_updates = []
+            transaction_updates = []
+            user_ids = set()
+            for event in paid_events:
+                transaction = transactions.get(event["session_id"])
+                if not transaction or transaction.get("payment_status") == "paid":
+                    continue
+                plan = event["metadata"].get("plan", "monthly")
+                user_id = event["metadata"].get("user_id")
+                user_updates.append(UpdateOne(*paid_subscription_update(event["session_id"], user_id, plan)))
+                transaction_updates.append(UpdateOne({"session_id": event["session_id"]}, TRANSACTION_PAID_UPDATE))
+                user_ids.add(user_id)
+            
+            if user_updates:
+                await db.users.bulk_write(user_updates, ordered=False)
+                await invalidate_user_sessions(user_ids)
+                await db.payment_transactions.bulk_write(transaction_updates, ordered=False)
+            
+            await db.webhook_events.update_many(
+                {"_id": {"$in": [event["_id"] for event in batch]}},
+                {"$set": {"status": "processed", "processed_at": datetime.now(timezone.utc)}, "$unset": {"locked_until": ""}}
+            )
+            self.processed += len(batch)
+        except Exception as e:
+            logging.error(f"Webhook batch failed, scheduling retry: {e}")
+            await self._schedule_retry(batch, str(e))
+
+    async def _schedule_retry(self, batch: list, error: str):
+        now = datetime.now(timezone.utc)
+        for event in batch:
+            attempts = event.get("attempts", 0) + 1
+            self.failed += 1
+            delay = min(3600.0, self.backoff_base * (2 ** attempts)) * random.uniform(0.5, 1.0)
+            await db.webhook_events.update_one(
+                {"_id": event["_id"]},
+                {"$set": {
+                    "status": "dead" if attempts >= self.max_attempts else "failed",
+                    "attempts": attempts,
+                    "last_error": error,
+                    "next_attempt_at": now + timedelta(seconds=delay)
+                }, "$unset": {"locked_until": ""}}
+            )
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._workers),
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "processed": self.processed,
+            "failed": self.failed
+        }
+
+webhook_inbox = WebhookInbox(
+    workers=int(os.environ.get("WEBHOOK_WORKERS", "2")),
+    batch_size=int(os.environ.get("WEBHOOK_BATCH_SIZE", "50")),
+    poll_interval=float(os.environ.get("WEBHOOK_POLL_INTERVAL_SECONDS", "5")),
+    max_attempts=int(os.environ.get("WEBHOOK_MAX_ATTEMPTS", "8"))
+)
+
+class SubscriptionSweeper:
+    """Periodically downgrades expired subscriptions and maintains users.has_premium"""
+
+    def __init__(self, interval_seconds: float, batch_size: int):
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self._loop = BackgroundLoop(self._run)
+        self.runs = 0
+        self.total_downgraded = 0
+        self.last_run_at = None
+        self.last_duration_ms = None
+        self.last_downgraded = 0
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def _run(self):
+        try:
+            await self.backfill()
+        except Exception as e:
+            logging.error(f"has_premium backfill failed: {e}")
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logging.error(f"Subscription sweep failed: {e}")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def backfill(self):
+        """Set has_premium on users created before the flag existed.
+
+        Expired paid users are flagged too, so the following sweep downgrades them.
+        """
+        await db.users.update_many(
+            {"has_premium": {"$exists": False}, "subscription_plan": {"$in": list(PREMIUM_PLANS)}},
+            {"$set": {"has_premium": True}}
+        )
+        await db.users.update_many({"has_premium": {"$exists": False}}, {"$set": {"has_premium": False}})
+
+    async def sweep(self) -> int:
+        """Downgrade every flagged user whose subscription has expired; returns the count"""
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        downgraded = 0
+        while True:
+            expired = await db.users.find(
+                {"has_premium": True, "subscription_expires": {"$lte": now}},
+                {"_id": 0, "user_id": 1}
+            ).limit(self.batch_size).to_list(self.batch_size)
+            if not expired:
+                break
+            # Re-check expiry in the filter so a renewal racing the sweep wins
+            result = await db.users.bulk_write([
+                UpdateOne(
+                    {"user_id": user["user_id"], "has_premium": True, "subscription_expires": {"$lte": now}},
+                    {"$set": {"subscription_plan": "free", "has_premium": False}}
+                )
+                for user in expired
+            ], ordered=False)
+            await invalidate_user_sessions(user["user_id"] for user in expired)
+            downgraded += result.modified_count
+            if len(expired) < self.batch_size:
+                break
+        
+        self.runs += 1
+        self.total_downgraded += downgraded
+        self.last_run_at = now
+        self.last_duration_ms = (time.perf_counter() - started) * 1000
+        self.last_downgraded = downgraded
+        if downgraded:
+            logging.info(f"Subscription sweep downgraded {downgraded} users in {self.last_duration_ms:.1f} ms")
+        return downgraded
+
+    def stats(self) -> dict:
+        return {
+            "runs": self.runs,
+            "total_downgraded": self.total_downgraded,
+            "last_run_at": self.last_run_at,
+            "last_duration_ms": self.last_duration_ms,
+            "last_downgraded": self.last_downgraded
+        }
+
+subscription_sweeper = SubscriptionSweeper(
+    interval_seconds=float(os.environ.get("SUBSCRIPTION_SWEEP_INTERVAL_SECONDS", "300")),
+    batch_size=int(os.environ.get("SUBSCRIPTION_SWEEP_BATCH_SIZE", "500"))
+)
+
+class WatchProgressBuffer:
+    """Write-behind buffer for playback heartbeats.
+
+    A heartbeat overwrites the pending entry for its (user, video), so a flush
+    writes at most one upsert per pair however often clients report. Flushes
+    run every `flush_seconds`, early once `max_pending` pairs are waiting, and
+    once more on shutdown.
+    """
+
+    def __init__(self, flush_seconds: float, max_pending: int, batch_size: int, completed_ratio: float = 0.95):
+        self.flush_seconds = flush_seconds
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.completed_ratio = completed_ratio
+        self._pending = {}
+        self._count = 0
+        self._loop = BackgroundLoop(self._run)
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self.heartbeats = 0
+        self.coalesced = 0
+        self.flushes = 0
+        self.written = 0
+        self.last_flush_ms = None
+
+    def record(self, user_id: str, video_id: str, position: float, duration: Optional[float]):
+        entries = self._pending.setdefault(user_id, {})
+        if video_id in entries:
+            self.coalesced += 1
+        else:
+            self._count += 1
+        entries[video_id] = {
+            "position_seconds": position,
+            "duration_seconds": duration,
+            "completed": duration is not None and position >= duration * self.completed_ratio,
+            "updated_at": datetime.now(timezone.utc)
+        }
+        self.heartbeats += 1
+        if self._count >= self.max_pending:
+            self._wakeup.set()
+
+    def pending_for(self, user_id: str) -> dict:
+        """Unflushed entries for one user, video_id -> entry (newer than anything stored)"""
+        return self._pending.get(user_id, {})
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            pending, self._pending, self._count = self._pending, {}, 0
+            if not pending:
+                return 0
+            started = time.perf_counter()
+            operations = [
+                UpdateOne({"user_id": user_id, "video_id": video_id}, {"$set": entry}, upsert=True)
+                for user_id, entries in pending.items()
+                for video_id, entry in entries.items()
+            ]
+            try:
+                for start in range(0, len(operations), self.batch_size):
+                    await db.watch_progress.bulk_write(operations[start:start + self.batch_size], ordered=False)
+            except Exception:
+                self._restore(pending)
+                raise
+            self.flushes += 1
+            self.written += len(operations)
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            return len(operations)
+
+    def _restore(self, pending: dict):
+        """Re-queue a failed flush, keeping any heartbeat that arrived since (upserts are idempotent)"""
+        for user_id, entries in pending.items():
+            current = self._pending.setdefault(user_id, {})
+            for video_id, entry in entries.items():
+                if video_id not in current:
+                    current[video_id] = entry
+                    self._count += 1
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Final watch progress flush failed, {self._count} entries lost: {e}")
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Watch progress flush failed, will retry: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "pending": self._count,
+            "heartbeats": self.heartbeats,
+            "coalesced": self.coalesced,
+            "flushes": self.flushes,
+            "written": self.written,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+watch_progress = WatchProgressBuffer(
+    flush_seconds=float(os.environ.get("WATCH_PROGRESS_FLUSH_SECONDS", "2")),
+    max_pending=int(os.environ.get("WATCH_PROGRESS_MAX_PENDING", "50000")),
+    batch_size=int(os.environ.get("WATCH_PROGRESS_BATCH_SIZE", "1000"))
+)
+
+class HyperLogLog:
+    """Sparse HyperLogLog sketches stored as {register index (str): rank}.
+
+    String keys let Mongo merge sketches in place with per-register $max.
+    """
+
+    PRECISION = 11
+    REGISTERS = 1 << PRECISION
+    ALPHA = 0.7213 / (1 + 1.079 / REGISTERS)
+
+    @classmethod
+    def add(cls, registers: dict, value: str):
+        hashed = int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+        index = str(hashed >> (64 - cls.PRECISION))
+        remainder = hashed & ((1 << (64 - cls.PRECISION)) - 1)
+        rank = (64 - cls.PRECISION) - remainder.bit_length() + 1
+        if rank > registers.get(index, 0):
+            registers[index] = rank
+
+    @staticmethod
+    def merge(into: dict, registers: dict):
+        for index, rank in registers.items():
+            if rank > into.get(index, 0):
+                into[index] = rank
+
+    @classmethod
+    def estimate(cls, registers: dict) -> int:
+        zeros = cls.REGISTERS - len(registers)
+        harmonic = zeros + sum(2.0 ** -rank for rank in registers.values())
+        estimate = cls.ALPHA * cls.REGISTERS * cls.REGISTERS / harmonic
+        if estimate <= 2.5 * cls.REGISTERS and zeros:
+            # Linear counting is more accurate for small cardinalities
+            estimate = cls.REGISTERS * math.log(cls.REGISTERS / zeros)
+        return round(estimate)
+
+class ViewAnalytics:
+    """Per-video view counts and unique-viewer sketches, flushed to hourly and daily rollups.
+
+    Views are counted in memory per (granularity, bucket, video) and written in
+    batches with $inc for counts and per-register $max for sketches, so flushes
+    from any number of workers merge correctly.
+    """
+
+    GRANULARITIES = ("hour", "day")
+
+    def __init__(self, flush_seconds: float, batch_size: int, hourly_retention_days: int):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.hourly_retention = timedelta(days=hourly_retention_days)
+        self._pending = {}
+        self._loop = BackgroundLoop(self._run)
+        self._flush_lock = asyncio.Lock()
+        self.views = 0
+        self.flushes = 0
+        self.written = 0
+        self.last_flush_ms = None
+
+    @staticmethod
+    def bucket_start(moment: datetime, granularity: str) -> datetime:
+        if granularity == "day":
+            return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+        return moment.replace(minute=0, second=0, microsecond=0)
+
+    def record(self, video: dict, viewer: str):
+        now = datetime.now(timezone.utc)
+        for granularity in self.GRANULARITIES:
+            key = (granularity, self.bucket_start(now, granularity), video["video_id"])
+            entry = self._pending.get(key)
+            if entry is None:
+                entry = self._pending[key] = {"category": video.get("category"), "views": 0, "registers": {}}
+            entry["views"] += 1
+            HyperLogLog.add(entry["registers"], viewer)
+        self.views += 1
+
+    def _operations(self, pending: dict) -> list:
+        operations = []
+        for (granularity, bucket, video_id), entry in pending.items():
+            on_insert = {"category": entry["category"]}
+            if granularity == "hour":
+                on_insert["expires_at"] = bucket + self.hourly_retention
+            operations.append(UpdateOne(
+                {"granularity": granularity, "bucket": bucket, "video_id": video_id},
+                {
+                    "$inc": {"views": entry["views"]},
+                    "$max": {f"hll.{index}": rank for index, rank in entry["registers"].items()},
+                    "$setOnInsert": on_insert
+                },
+                upsert=True
+            ))
+        return operations
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            started = time.perf_counter()
+            items = list(pending.items())
+            written = 0
+            chunk_size = max(1, self.batch_size)
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                try:
+                    await db.video_view_rollups.bulk_write(self._operations(dict(chunk)), ordered=False)
+                except BulkWriteError as e:
+                    # Only failed writes are re-queued; retrying the rest would double-count views
+                    self._restore(dict(chunk[error["index"]] for error in e.details.get("writeErrors", [])))
+                    self._restore(dict(items[start + chunk_size:]))
+                    raise
+                except Exception:
+                    self._restore(dict(items[start:]))
+                    raise
+                written += len(chunk)
+            self.flushes += 1
+            self.written += written
+            self.last_flush_ms = (time.perf_counter() - started) * 1000
+            return written
+
+    def _restore(self, pending: dict):
+        for key, entry in pending.items():
+            current = self._pending.get(key)
+            if current is None:
+                self._pending[key] = entry
+                continue
+            current["views"] += entry["views"]
+            HyperLogLog.merge(current["registers"], entry["registers"])
+
+    def start(self):
+        self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+        try:
+            await self.flush()
+        except Exception as e:
+            logging.error(f"Final view analytics flush failed: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"View analytics flush failed, will retry: {e}")
+
+    async def top_videos(self, start: datetime, end: datetime, category: Optional[str], limit: int) -> dict:
+        """Top videos by views in [start, end), from rollups only; daily buckets beyond 48 hours"""
+        granularity = "hour" if end - start <= timedelta(hours=48) else "day"
+        match = {"granularity": granularity, "bucket": {"$gte": self.bucket_start(start, granularity), "$lt": end}}
+        if category:
+            match["category"] = category
+        rows = await db.video_view_rollups.aggregate([
+            {"$match": match},
+            {"$group": {"_id": "$video_id", "views": {"$sum": "$views"}, "category": {"$first": "$category"}}},
+            {"$sort": {"views": -1, "_id": 1}},
+            {"$limit": limit}
+        ]).to_list(limit)
+        
+        sketches = {row["_id"]: {} for row in rows}
+        if rows:
+            async for doc in db.video_view_rollups.find(
+                {**match, "video_id": {"$in": list(sketches)}}, {"_id": 0, "video_id": 1, "hll": 1}
+            ):
+                HyperLogLog.merge(sketches[doc["video_id"]], doc.get("hll", {}))
+        
+        snapshot = await catalog.get()
+        return {
+            "granularity": granularity,
+            "start": match["bucket"]["$gte"],
+            "end": end,
+            "category": category,
+            "videos": [
+                {
+                    "video_id": row["_id"],
+                    "title": snapshot.by_id.get(row["_id"], {}).get("title"),
+                    "category": row["category"],
+                    "views": row["views"],
+                    "unique_viewers": HyperLogLog.estimate(sketches[row["_id"]])
+                }
+                for row in rows
+            ]
+        }
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "views": self.views,
+            "flushes": self.flushes,
+            "written": self.written,
+            "last_flush_ms": self.last_flush_ms
+        }
+
+view_analytics = ViewAnalytics(
+    flush_seconds=float(os.environ.get("VIEW_ANALYTICS_FLUSH_SECONDS", "10")),
+    batch_size=int(os.environ.get("VIEW_ANALYTICS_BATCH_SIZE", "1000")),
+    hourly_retention_days=int(os.environ.get("VIEW_ANALYTICS_HOURLY_RETENTION_DAYS", "30"))
+)
+
+class SearchIndex:
+    """In-memory inverted index over video title, description and category.
+
+    Each term keeps its postings in impact order (highest field-weighted term
+    frequency first), so queries walk the rarest term's best matches and stop
+    as soon as no remaining posting can beat the current top results. Scores
+    are weight times inverse document frequency; the last query term also
+    matches as a prefix for search-as-you-type.
+
+    The walk is capped at MAX_SCANNED postings to keep search off the event
+    loop's critical path. This is an approximation: a full top may then miss
+    lower-impact matches. If fewer than `limit` videos matched within the cap,
+    the exact intersection of all terms is scored instead, so a query never
+    returns fewer results than actually match.
+    """
+
+    FIELD_WEIGHTS = {"title": 3.0, "category": 2.0, "description": 1.0}
+    # Letters and digits in any script; accents are stripped before matching
+    TOKEN_PATTERN = re.compile(r'[^\W_]+')
+    MAX_PREFIX_EXPANSIONS = 16
+    MAX_SCANNED = 256
+
+    def __init__(self):
+        self.postings = {}
+        self.impacts = {}
+        self.vocabulary = []
+        self.videos = {}
+        self.built = False
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        """Drop the index; it is rebuilt from the catalog on next use"""
+        self.built = False
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        if not text:
+            return []
+        decomposed = unicodedata.normalize("NFKD", text.casefold())
+        return cls.TOKEN_PATTERN.findall("".join(char for char in decomposed if not unicodedata.combining(char)))
+
+    async def ensure_built(self):
+        if not self.built:
+            async with self._lock:
+                if not self.built:
+                    snapshot = await catalog.get()
+                    self.rebuild(snapshot.videos)
+
+    def rebuild(self, videos: list):
+        self.postings = {}
+        self.impacts = {}
+        self.videos = {}
+        for video in videos:
+            self.videos[video["video_id"]] = video
+            for term, weight in self._terms(video).items():
+                self.postings.setdefault(term, {})[video["video_id"]] = weight
+        for term, postings in self.postings.items():
+            self.impacts[term] = sorted(
+                (-weight, self.videos[video_id].get("order", 0), video_id)
+                for video_id, weight in postings.items()
+            )
+        self.vocabulary = sorted(self.postings)
+        self.built = True
+
+    def add(self, video: dict):
+        """Index a newly created video (no-op until the index is first built)"""
+        if not self.built:
+            return
+        self.remove(video["video_id"])
+        self.videos[video["video_id"]] = video
+        for term, weight in self._terms(video).items():
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = {}
+                self.impacts[term] = []
+                bisect.insort(self.vocabulary, term)
+            postings[video["video_id"]] = weight
+            bisect.insort(self.impacts[term], (-weight, video.get("order", 0), video["video_id"]))
+
+    def remove(self, video_id: str):
+        video = self.videos.pop(video_id, None)
+        if video is None:
+            return
+        for term in self._terms(video):
+            postings = self.postings.get(term)
+            if postings is None or video_id not in postings:
+                continue
+            entry = (-postings.pop(video_id), video.get("order", 0), video_id)
+            impacts = self.impacts[term]
+            index = bisect.bisect_left(impacts, entry)
+            if index < len(impacts) and impacts[index] == entry:
+                del impacts[index]
+            if not postings:
+                del self.postings[term]
+                del self.impacts[term]
+                index = bisect.bisect_left(self.vocabulary, term)
+                if index < len(self.vocabulary) and self.vocabulary[index] == term:
+                    del self.vocabulary[index]
+
+    def _terms(self, video: dict) -> dict:
+        weights = {}
+        for field, field_weight in self.FIELD_WEIGHTS.items():
+            for term in self.tokenize(video.get(field, "")):
+                weights[term] = weights.get(term, 0.0) + field_weight
+        return weights
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        """Up to MAX_PREFIX_EXPANSIONS completions of a prefix, most common first"""
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\U0010ffff", start)
+        return heapq.nlargest(
+            self.MAX_PREFIX_EXPANSIONS, self.vocabulary[start:end], key=lambda term: len(self.postings[term])
+        )
+
+    @staticmethod
+    def _match_score(video_id: str, lookups: list, score: float) -> Optional[float]:
+        """`score` plus the video's best weight in every group; None if a group misses it"""
+        for group in lookups:
+            best = 0.0
+            for postings, factor in group:
+                weight = postings.get(video_id)
+                if weight is not None and weight * factor > best:
+                    best = weight * factor
+            if not best:
+                return None
+            score += best
+        return score
+
+    @staticmethod
+    def _offer(top: list, limit: int, entry: tuple):
+        if len(top) < limit:
+            heapq.heappush(top, entry)
+        elif entry > top[0]:
+            heapq.heapreplace(top, entry)
+
+    def search(self, query: str, limit: int = 20) -> List[dict]:
+        """Videos matching every query term (the last one as a prefix), best first"""
+        terms = self.tokenize(query)
+        if not terms:
+            return []
+        total = len(self.videos) or 1
+        
+        # One group per query term: [(term, score factor)] over its exact/prefix matches
+        groups = []
+        for position, term in enumerate(terms):
+            expansions = [term] if term in self.postings else []
+            if position == len(terms) - 1 and len(term) >= 2:
+                expansions = self._prefix_terms(term) or expansions
+            if not expansions:
+                return []
+            groups.append([
+                # Exact matches outrank prefix completions
+                (expansion, math.log(1 + total / len(self.postings[expansion])) * (1.0 if expansion == term else 0.5))
+                for expansion in expansions
+            ])
+        
+        # Drive from the group with the fewest postings; the rest are lookups
+        groups.sort(key=lambda group: sum(len(self.postings[term]) for term, _ in group))
+        driver, others = groups[0], groups[1:]
+        others_max = sum(
+            max(-self.impacts[term][0][0] * factor for term, factor in group) for group in others
+        )
+        lookups = [[(self.postings[term], factor) for term, factor in group] for group in groups]
+        if len(driver) == 1:
+            candidates = self.impacts[driver[0][0]]
+            driver_factor = driver[0][1]
+        else:
+            candidates = heapq.merge(*(
+                ((negative_weight * factor, order, video_id) for negative_weight, order, video_id in self.impacts[term])
+                for term, factor in driver
+            ))
+            driver_factor = 1.0
+        
+        top = []
+        seen = set()
+        capped = False
+        for negative_score, order, video_id in candidates:
+            score = -negative_score * driver_factor
+            # Candidates arrive best-first, so once this bound loses to the worst
+            # kept result no later candidate can enter the top either
+            if len(top) == limit and (score + others_max, -order) < top[0][:2]:
+                break
+            if video_id in seen:
+                continue
+            if len(seen) == self.MAX_SCANNED:
+                capped = True
+                break
+            seen.add(video_id)
+            score = self._match_score(video_id, lookups[1:], score)
+            if score is not None:
+                self._offer(top, limit, (score, -order, video_id))
+        
+        if capped and len(top) < limit:
+            # Too few matches among the driver's best postings: score the exact
+            # intersection instead, with set operations rather than a per-posting loop
+            keys = [
+                self.postings[terms[0]].keys() if len(terms) == 1 else set().union(*(self.postings[term].keys() for term in terms))
+                # A repeated query term narrows nothing
+                for terms in dict.fromkeys(tuple(term for term, _ in group) for group in groups)
+            ]
+            matches = set(keys[0]) if len(keys) == 1 else keys[0] & keys[1]
+            for other in keys[2:]:
+                matches = {video_id for video_id in matches if video_id in other}
+            for video_id in matches - seen:
+                score = self._match_score(video_id, lookups, 0.0)
+                self._offer(top, limit, (score, -self.videos[video_id].get("order", 0), video_id))
+        
+        return [self.videos[video_id] for _, _, video_id in sorted(top, reverse=True)]
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[str]:
+        """Vocabulary completions of a prefix, most common first"""
+        terms = self.tokenize(prefix)
+        if not terms:
+            return []
+        return self._prefix_terms(terms[-1])[:limit]
+
+search_index = SearchIndex()
+
+class CategorySummary:
+    """Materialized per-category counts, updated incrementally as videos change"""
+
+    def __init__(self):
+        self._members = {}
+        self._summary = None
+        self._etag = None
+        self._names_json = None
+        self._summary_json = None
+        self.built = False
+        self._lock = asyncio.Lock()
+
+    async def ensure_built(self):
+        if not self.built:
+            async with self._lock:
+                if not self.built:
+                    snapshot = await catalog.get()
+                    self.rebuild(snapshot.videos)
+
+    def invalidate(self):
+        self.built = False
+
+    def rebuild(self, videos: list):
+        self._members = {}
+        for video in videos:
+            self._add(video)
+        self._summary = None
+        self.built = True
+
+    def add(self, video: dict):
+        if self.built:
+            self._add(video)
+            self._summary = None
+
+    def remove(self, video: dict):
+        if not self.built:
+            return
+        members = self._members.get(video.get("category"))
+        if members is not None:
+            members.pop(video["video_id"], None)
+            if not members:
+                del self._members[video.get("category")]
+        self._summary = None
+
+    def _add(self, video: dict):
+        self._members.setdefault(video.get("category"), {})[video["video_id"]] = (
+            video.get("order", 0), bool(video.get("is_premium", False))
+        )
+
+    def summary(self):
+        """(rows sorted by name, ETag); rows are recomputed only after a change"""
+        if self._summary is None:
+            self._summary = [
+                {
+                    "name": name,
+                    "total": len(members),
+                    "premium": sum(1 for _, is_premium in members.values() if is_premium),
+                    "latest_order": max(order for order, _ in members.values())
+                }
+                for name, members in sorted(self._members.items(), key=lambda item: str(item[0]))
+            ]
+            self._summary_json = orjson.dumps(self._summary)
+            self._names_json = orjson.dumps([row["name"] for row in self._summary])
+            self._etag = f'W/"{hashlib.sha1(self._summary_json).hexdigest()[:20]}"'
+        return self._summary, self._etag
 
-ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'edric.yan2022@gmail.com')
+    def names_json(self):
+        self.summary()
+        return self._names_json, self._etag
 
-# Subscription pricing
-SUBSCRIPTION_PLANS = {
-    "free": {"price": 0.0, "name": "Free Plan", "features": ["Basic wrestling techniques", "Beginner tutorials"]},
-    "monthly": {"price": 19.99, "name": "Monthly Pro", "features": ["All basic techniques", "Secret techniques", "Advanced moves", "Priority support"]},
-    "annual": {"price": 149.99, "name": "Annual Pro", "features": ["All basic techniques", "Secret techniques", "Advanced moves", "Priority support", "2 months free"]}
-}
+    def summary_json(self):
+        self.summary()
+        return self._summary_json, self._etag
 
-app = FastAPI()
-api_router = APIRouter(prefix="/api")
+category_summary = CategorySummary()
 
-# Pydantic Models
-class User(BaseModel):
-    user_id: str
-    email: str
-    name: str
-    picture: Optional[str] = None
-    subscription_plan: str = "free"
-    subscription_expires: Optional[datetime] = None
-    created_at: datetime
+class InvalidationBus:
+    """Keeps per-worker state derived from videos, users and user_sessions coherent.
 
-class UserSession(BaseModel):
-    session_token: str
-    user_id: str
-    expires_at: datetime
-    created_at: datetime
+    A writer bumps the topic's version document in `cache_versions` and
+    appends the changed keys (a user_id; None for "everything") to its
+    `recent` list, which keeps the last RECENT_KEYS entries. Other workers
+    follow these documents with a change stream when the deployment supports
+    one (replica sets) and poll them otherwise. A worker that falls further
+    behind than the recent list drops the whole topic.
+    """
 
-class Video(BaseModel):
-    video_id: str
-    title: str
-    description: str
-    category: str
-    video_url: str
-    thumbnail_url: Optional[str] = None
-    is_premium: bool = False
-    order: int = 0
-    created_at: datetime
+    RECENT_KEYS = 256
 
-class VideoCreate(BaseModel):
-    title: str
-    description: str
-    category: str
-    video_url: str
-    thumbnail_url: Optional[str] = None
-    is_premium: bool = False
+    def __init__(self, poll_seconds: float):
+        self.poll_seconds = poll_seconds
+        self.worker_id = uuid.uuid4().hex
+        self.mode = None
+        self._subscribers = {}
+        self._versions = {}
+        self._loop = BackgroundLoop(self._run)
+        self.published = 0
+        self.applied = 0
+        self.full_resets = 0
 
-def extract_youtube_id(url: str) -> Optional[str]:
-    """Extract YouTube video ID from various URL formats"""
-    patterns = [
-        r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([^&\n?#]+)',
-        r'youtube\.com\/shorts\/([^&\n?#]+)',
-    ]
-    for pattern in patterns:
-        match = re.search(pattern, url)
-        if match:
-            return match.group(1)
-    return None
+    def subscribe(self, topic: str, on_key, on_all):
+        self._subscribers[topic] = (on_key, on_all)
 
-def convert_to_embed_url(url: str) -> str:
-    """Convert any YouTube URL to embed format"""
-    video_id = extract_youtube_id(url)
-    if video_id:
-        return f"https://www.youtube.com/embed/{video_id}"
-    return url  # Return as-is if not a YouTube URL
+    async def publish(self, topic: str, keys=(None,)):
+        """Tell other workers that `keys` of `topic` changed (callers update their own state)"""
+        entries = [{"key": key, "origin": self.worker_id} for key in keys]
+        await db.cache_versions.update_one(
+            {"_id": topic},
+            {"$inc": {"version": len(entries)}, "$push": {"recent": {"$each": entries, "$slice": -self.RECENT_KEYS}}},
+            upsert=True
+        )
+        self.published += len(entries)
+
+    def _apply(self, doc: dict):
+        topic = doc["_id"]
+        if topic not in self._subscribers:
+            return
+        version = doc.get("version", 0)
+        seen = self._versions.get(topic)
+        self._versions[topic] = version
+        if seen is None or version <= seen:
+            return
+        on_key, on_all = self._subscribers[topic]
+        # The version counts entries, so the last (version - seen) are new to us
+        recent = doc.get("recent", [])
+        missed = version - seen
+        if missed > len(recent):
+            on_all()
+            self.full_resets += 1
+            return
+        for entry in recent[len(recent) - missed:]:
+            if entry.get("origin") == self.worker_id:
+                continue
+            if entry.get("key") is None:
+                on_all()
+            else:
+                on_key(entry["key"])
+            self.applied += 1
+
+    async def poll(self):
+        async for doc in db.cache_versions.find({"_id": {"$in": list(self._subscribers)}}):
+            self._apply(doc)
+
+    async def start(self):
+        if not self._loop.running:
+            # Baseline versions; nothing cached yet needs dropping
+            async for doc in db.cache_versions.find({"_id": {"$in": list(self._subscribers)}}, {"version": 1}):
+                self._versions[doc["_id"]] = doc.get("version", 0)
+            for topic in self._subscribers:
+                self._versions.setdefault(topic, 0)
+            self._loop.start()
+
+    async def stop(self):
+        await self._loop.stop()
+
+    async def _run(self):
+        use_change_stream = True
+        while True:
+            if use_change_stream:
+                opened = False
+                try:
+                    async with db.cache_versions.watch(
+                        [{"$match": {"documentKey._id": {"$in": list(self._subscribers)}}}],
+                        full_document="updateLookup"
+                    ) as stream:
+                        opened = True
+                        self.mode = "change_stream"
+                        # Catch up on anything published before the stream opened
+                        await self.poll()
+                        async for change in stream:
+                            if change.get("fullDocument"):
+                                self._apply(change["fullDocument"])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    if not opened:
+                        # e.g. a standalone server, which has no change streams
+                        logging.info(f"Change streams unavailable, polling cache versions instead: {e}")
+                        use_change_stream = False
+                    else:
+                        logging.error(f"Invalidation change stream failed, reopening: {e}")
+                        await asyncio.sleep(self.poll_seconds)
+                continue
+            
+            self.mode = "polling"
+            try:
+                await self.poll()
+            except Exception as e:
+                logging.error(f"Cache version poll failed: {e}")
+            await asyncio.sleep(self.poll_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "mode": self.mode,
+            "versions": dict(self._versions),
+            "published": self.published,
+            "applied": self.applied,
+            "full_resets": self.full_resets
+        }
+
+def invalidate_video_state():
+    catalog.invalidate()
+    search_index.invalidate()
+    category_summary.invalidate()
+
+invalidation_bus = InvalidationBus(poll_seconds=float(os.environ.get("INVALIDATION_POLL_SECONDS", "2")))
+invalidation_bus.subscribe("videos", on_key=lambda _: invalidate_video_state(), on_all=invalidate_video_state)
+invalidation_bus.subscribe("users", on_key=session_cache.invalidate_user, on_all=session_cache.clear)
+
+VIDEO_ORDER_COUNTER = "video_order"
+
+async def seed_video_order_counter():
+    """Make sure the order counter is at least the highest existing order ($max is idempotent)"""
+    last_video = await db.videos.find_one({}, {"_id": 0, "order": 1}, sort=[("order", -1)])
+    await db.counters.update_one(
+        {"_id": VIDEO_ORDER_COUNTER},
+        {"$max": {"value": last_video.get("order", 0) if last_video else 0}},
+        upsert=True
+    )
+
+async def reserve_video_orders(count: int) -> int:
+    """Atomically reserve `count` consecutive order numbers; returns the first"""
+    counter = await db.counters.find_one_and_update(
+        {"_id": VIDEO_ORDER_COUNTER},
+        {"$inc": {"value": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["value"] - count + 1
+
+def build_video_doc(video: VideoCreate, order: int) -> dict:
+    return {
+        "video_id": f"vid_{uuid.uuid4().hex[:12]}",
+        "title": video.title,
+        "description": video.description,
+        "category": video.category,
+        "video_url": convert_to_embed_url(video.video_url),
+        "thumbnail_url": video.thumbnail_url,
+        "is_premium": video.is_premium,
+        "order": order,
+        "created_at": datetime.now(timezone.utc)
+    }
+
+VIDEO_CSV_FIELDS = ["title", "description", "category", "video_url", "thumbnail_url", "is_premium"]
+
+async def iter_import_records(request: Request, is_csv: bool):
+    """Yield (line number, dict | error message) from a streamed JSON Lines or CSV body"""
+    buffer = ""
+    pending = ""
+    line_number = 0
+    header = None
+    # Chunks may split a multibyte character; the decoder carries the partial bytes
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    async for chunk in request.stream():
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line_number += 1
+            if is_csv:
+                # Hold lines until quotes balance so quoted fields may span lines
+                pending = f"{pending}\n{line}" if pending else line
+                if pending.count('"') % 2:
+                    continue
+                line, pending = pending, ""
+            if not line.strip():
+                continue
+            if not is_csv:
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, f"Invalid JSON: {e}"
+                continue
+            row = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in row]
+                continue
+            yield line_number, dict(zip(header, row))
+    
+    buffer += decoder.decode(b"", final=True)
+    trailing = f"{pending}\n{buffer}" if pending else buffer
+    if trailing.strip():
+        line_number += 1
+        if not is_csv:
+            try:
+                yield line_number, json.loads(trailing)
+            except ValueError as e:
+                yield line_number, f"Invalid JSON: {e}"
+        elif header is not None:
+            yield line_number, dict(zip(header, next(csv.reader([trailing]))))
+
+def parse_import_record(record: dict) -> VideoCreate:
+    if not isinstance(record, dict):
+        raise ValueError(f"Expected an object, got {type(record).__name__}")
+    if "is_premium" in record and isinstance(record["is_premium"], str):
+        record["is_premium"] = record["is_premium"].strip().lower() in ("1", "true", "yes", "y")
+    if not record.get("thumbnail_url"):
+        record["thumbnail_url"] = None
+    return VideoCreate(**record)
 
 class PaymentTransaction(BaseModel):
     transaction_id: str
@@ -104,9 +2578,10 @@ class PaymentTransaction(BaseModel):
     created_at: datetime
 
 # Auth endpoints
-@api_router.post("/auth/session")
+@api_router.post("/auth/session", response_model=UserProfile)
 async def process_session(request: Request, response: Response):
     """Process session_id from Google OAuth and create user session"""
+    rate_limiter.check(request, "login")
     data = await request.json()
     session_id = data.get("session_id")
     
@@ -114,16 +2589,10 @@ async def process_session(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="session_id required")
     
     # Fetch user data from Emergent Auth
-    async with httpx.AsyncClient() as client:
-        auth_response = await client.get(
-            "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-            headers={"X-Session-ID": session_id}
-        )
-        
-        if auth_response.status_code != 200:
-            raise HTTPException(status_code=401, detail="Invalid session")
-        
-        user_data = auth_response.json()
+    async with auth_bulkhead.slot():
+        user_data = await auth_client.get_session_data(session_id)
+    if user_data is None:
+        raise HTTPException(status_code=401, detail="Invalid session")
     
     email = user_data.get("email")
     name = user_data.get("name")
@@ -150,37 +2619,34 @@ async def process_session(request: Request, response: Response):
             "picture": picture,
             "subscription_plan": "free",
             "subscription_expires": None,
-            "created_at": datetime.now(timezone.utc).isoformat()
+            "has_premium": False,
+            "created_at": datetime.now(timezone.utc)
         }
         await db.users.insert_one(new_user)
     
     # Create session
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
+    expires_at = datetime.now(timezone.utc) + SESSION_LIFETIME
     session_doc = {
         "session_token": session_token,
         "user_id": user_id,
-        "expires_at": expires_at.isoformat(),
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "expires_at": expires_at,
+        "created_at": datetime.now(timezone.utc)
     }
     
     # Remove old sessions for this user
-    await db.user_sessions.delete_many({"user_id": user_id})
+    removed = await db.user_sessions.delete_many({"user_id": user_id})
+    if removed.deleted_count:
+        await invalidate_user_sessions([user_id])
     await db.user_sessions.insert_one(session_doc)
     
-    # Set cookie
-    response.set_cookie(
-        key="session_token",
-        value=session_token,
-        httponly=True,
-        secure=True,
-        samesite="none",
-        path="/",
-        max_age=7 * 24 * 60 * 60
-    )
-    
     # Get user data
     user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
     
+    # Set cookie
+    if session_signer is not None:
+        session_token = session_signer.issue(session_token, user, expires_at)
+    set_session_cookie(response, session_token, expires_at)
+    
     return {
         "user_id": user["user_id"],
         "email": user["email"],
@@ -190,42 +2656,72 @@ async def process_session(request: Request, response: Response):
         "is_admin": user["email"] == ADMIN_EMAIL
     }
 
-async def get_current_user(request: Request):
-    """Helper to get current user from session"""
+def set_session_cookie(response: Response, value: str, expires_at: datetime):
+    response.set_cookie(
+        key="session_token",
+        value=value,
+        httponly=True,
+        secure=True,
+        samesite="none",
+        path="/",
+        max_age=max(0, int((expires_at - datetime.now(timezone.utc)).total_seconds()))
+    )
+
+def request_session_token(request: Request) -> Optional[str]:
     session_token = request.cookies.get("session_token")
     
     if not session_token:
         auth_header = request.headers.get("Authorization")
         if auth_header and auth_header.startswith("Bearer "):
             session_token = auth_header.split(" ")[1]
+    return session_token
+
+async def get_current_user(request: Request):
+    """Helper to get current user from session"""
+    session_token = request_session_token(request)
     
     if not session_token:
         return None
     
+    if session_signer is not None and session_token.startswith(SessionSigner.PREFIX):
+        claims = session_signer.verify(session_token)
+        if claims is None or session_revocations.session_revoked(claims["sid"]):
+            return None
+        if not session_revocations.user_revoked_since(claims["uid"], claims["iat"]):
+            return session_signer.user_from_claims(claims)
+        # Sessions or entitlement changed since the token was issued: check the database
+        request.state.stale_session_claims = claims
+        session_token = claims["sid"]
+    
+    cached_user = session_cache.get(session_token)
+    if cached_user is not None:
+        return cached_user
+    
     session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
     if not session:
         return None
     
     # Check expiry
-    expires_at = session["expires_at"]
-    if isinstance(expires_at, str):
-        expires_at = datetime.fromisoformat(expires_at)
-    if expires_at.tzinfo is None:
-        expires_at = expires_at.replace(tzinfo=timezone.utc)
-    
+    expires_at = as_utc(session["expires_at"])
     if expires_at < datetime.now(timezone.utc):
         return None
     
     user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
+    if user:
+        session_cache.set(session_token, user, expires_at)
     return user
 
-@api_router.get("/auth/me")
-async def get_me(request: Request):
+@api_router.get("/auth/me", response_model=UserProfile)
+async def get_me(request: Request, response: Response):
     """Get current authenticated user"""
     user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
+    refresh_stale_session(request, response, user)
+    return user_profile(user)
+
+def user_profile(user: dict) -> dict:
     return {
         "user_id": user["user_id"],
         "email": user["email"],
@@ -233,52 +2729,89 @@ async def get_me(request: Request):
         "picture": user.get("picture"),
         "subscription_plan": user.get("subscription_plan", "free"),
         "subscription_expires": user.get("subscription_expires"),
+        "created_at": user.get("created_at"),
         "is_admin": user["email"] == ADMIN_EMAIL
     }
 
+def refresh_stale_session(request: Request, response: Response, user: dict):
+    """Re-issue a stale signed token so later requests skip the database again"""
+    stale_claims = getattr(request.state, "stale_session_claims", None)
+    if stale_claims is not None:
+        expires_at = datetime.fromtimestamp(stale_claims["exp"], timezone.utc)
+        set_session_cookie(response, session_signer.issue(stale_claims["sid"], user, expires_at), expires_at)
+
 @api_router.post("/auth/logout")
 async def logout(request: Request, response: Response):
     """Logout user"""
     session_token = request.cookies.get("session_token")
+    if session_token and session_signer is not None and session_token.startswith(SessionSigner.PREFIX):
+        claims = session_signer.verify(session_token)
+        session_token = claims["sid"] if claims else None
+        if session_token:
+            await session_revocations.revoke_session(session_token)
     if session_token:
-        await db.user_sessions.delete_one({"session_token": session_token})
+        session = await db.user_sessions.find_one_and_delete({"session_token": session_token}, {"_id": 0, "user_id": 1})
+        session_cache.invalidate(session_token)
+        if session:
+            await invalidation_bus.publish("users", [session["user_id"]])
     
     response.delete_cookie(key="session_token", path="/", secure=True, samesite="none")
     return {"message": "Logged out successfully"}
 
 # Video endpoints
-@api_router.get("/videos")
-async def get_videos(request: Request):
-    """Get all videos, filtered by user subscription"""
+@api_router.get("/videos", response_model=List[VideoListItem])
+async def get_videos(
+    request: Request,
+    response: Response,
+    category: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=VIDEO_PAGE_MAX_LIMIT),
+    cursor: Optional[str] = None
+):
+    """Get all videos, filtered by user subscription.
+
+    Passing category, limit or cursor switches to a paged read; the cursor for
+    the next page is returned in the X-Next-Cursor header.
+    """
     user = await get_current_user(request)
     
-    videos = await db.videos.find({}, {"_id": 0}).sort("order", 1).to_list(1000)
-    
     # Check user subscription
-    has_premium = False
-    if user:
-        plan = user.get("subscription_plan", "free")
-        if plan in ["monthly", "annual"]:
-            expires = user.get("subscription_expires")
-            if expires:
-                if isinstance(expires, str):
-                    expires = datetime.fromisoformat(expires)
-                if expires.tzinfo is None:
-                    expires = expires.replace(tzinfo=timezone.utc)
-                has_premium = expires > datetime.now(timezone.utc)
-    
-    # Mark locked videos
-    for video in videos:
-        video["is_locked"] = video.get("is_premium", False) and not has_premium
-    
-    return videos
-
-@api_router.get("/videos/{video_id}")
+    has_premium = premium_status(user) == "active"
+    
+    if category is not None or limit is not None or cursor is not None:
+        videos, next_cursor = await fetch_video_page(category, limit or VIDEO_PAGE_DEFAULT_LIMIT, cursor)
+        for video in videos:
+            video["is_locked"] = video.get("is_premium", False) and not has_premium
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return videos
+    
+    snapshot = await catalog.get()
+    body, etag = snapshot.json_for(has_premium)
+    return cached_json_response(request, body, etag, "private, no-cache")
+
+@api_router.get("/videos/search", response_model=VideoSearchResponse)
+async def search_videos(
+    request: Request,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """Ranked search over title, description and category with prefix autocomplete"""
+    user = await get_current_user(request)
+    has_premium = premium_status(user) == "active"
+    
+    await search_index.ensure_built()
+    results = [
+        {**video, "is_locked": video.get("is_premium", False) and not has_premium}
+        for video in search_index.search(q, limit)
+    ]
+    return {"results": results, "suggestions": search_index.suggest(q)}
+
+@api_router.get("/videos/{video_id}", response_model=Video)
 async def get_video(video_id: str, request: Request):
     """Get single video"""
     user = await get_current_user(request)
     
-    video = await db.videos.find_one({"video_id": video_id}, {"_id": 0})
+    video = await db.videos.find_one({"video_id": video_id}, VIDEO_PROJECTION)
     if not video:
         raise HTTPException(status_code=404, detail="Video not found")
     
@@ -287,51 +2820,191 @@ async def get_video(video_id: str, request: Request):
         if not user:
             raise HTTPException(status_code=401, detail="Login required for premium content")
         
-        plan = user.get("subscription_plan", "free")
-        if plan not in ["monthly", "annual"]:
+        status = premium_status(user)
+        if status == "free":
             raise HTTPException(status_code=403, detail="Premium subscription required")
-        
-        expires = user.get("subscription_expires")
-        if expires:
-            if isinstance(expires, str):
-                expires = datetime.fromisoformat(expires)
-            if expires.tzinfo is None:
-                expires = expires.replace(tzinfo=timezone.utc)
-            if expires < datetime.now(timezone.utc):
-                raise HTTPException(status_code=403, detail="Subscription expired")
+        if status == "expired":
+            raise HTTPException(status_code=403, detail="Subscription expired")
     
+    viewer = user["user_id"] if user else f"{request.client.host if request.client else ''}|{request.headers.get('User-Agent', '')}"
+    view_analytics.record(video, viewer)
     return video
 
-@api_router.post("/videos")
+@api_router.post("/videos/{video_id}/progress")
+async def record_progress(video_id: str, heartbeat: ProgressHeartbeat, request: Request):
+    """Playback heartbeat; buffered in memory and written in batches"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    snapshot = await catalog.get()
+    if video_id not in snapshot.by_id:
+        raise HTTPException(status_code=404, detail="Video not found")
+    
+    watch_progress.record(user["user_id"], video_id, heartbeat.position_seconds, heartbeat.duration_seconds)
+    return {"status": "ok"}
+
+@api_router.get("/videos/{video_id}/progress")
+async def get_progress(video_id: str, request: Request):
+    """Last reported position for resuming playback"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    progress = watch_progress.pending_for(user["user_id"]).get(video_id)
+    if progress is None:
+        progress = await db.watch_progress.find_one(
+            {"user_id": user["user_id"], "video_id": video_id},
+            {"_id": 0, "position_seconds": 1, "duration_seconds": 1, "completed": 1}
+        )
+    if progress is None:
+        return {"position_seconds": 0, "duration_seconds": None, "completed": False}
+    return {
+        "position_seconds": progress["position_seconds"],
+        "duration_seconds": progress.get("duration_seconds"),
+        "completed": progress.get("completed", False)
+    }
+
+@api_router.get("/continue-watching", response_model=List[ContinueWatchingItem])
+async def continue_watching(request: Request, limit: int = Query(12, ge=1, le=50)):
+    """Unfinished videos, most recently watched first"""
+    user = await get_current_user(request)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    has_premium = premium_status(user) == "active"
+    
+    rows = await db.watch_progress.find(
+        {"user_id": user["user_id"], "completed": False},
+        {"_id": 0, "video_id": 1, "position_seconds": 1, "duration_seconds": 1, "updated_at": 1}
+    ).sort("updated_at", DESCENDING).limit(limit).to_list(limit)
+    progress = {row["video_id"]: row for row in rows}
+    for video_id, entry in watch_progress.pending_for(user["user_id"]).items():
+        if entry["completed"]:
+            progress.pop(video_id, None)
+        else:
+            progress[video_id] = {**entry, "video_id": video_id}
+    
+    snapshot = await catalog.get()
+    items = []
+    for row in sorted(progress.values(), key=lambda row: as_utc(row["updated_at"]), reverse=True):
+        video = snapshot.by_id.get(row["video_id"])
+        if video is None:
+            continue
+        items.append({
+            **video,
+            "is_locked": video.get("is_premium", False) and not has_premium,
+            "position_seconds": row["position_seconds"],
+            "duration_seconds": row.get("duration_seconds"),
+            "progress_updated_at": row["updated_at"]
+        })
+        if len(items) == limit:
+            break
+    return items
+
+@api_router.post("/videos", response_model=Video)
 async def create_video(video: VideoCreate, request: Request):
     """Create video (admin only)"""
     user = await get_current_user(request)
     if not user or user["email"] != ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    # Get next order number
-    last_video = await db.videos.find_one(sort=[("order", -1)])
-    next_order = (last_video.get("order", 0) + 1) if last_video else 1
-    
-    # Convert YouTube URL to embed format
-    embed_url = convert_to_embed_url(video.video_url)
-    
-    video_doc = {
-        "video_id": f"vid_{uuid.uuid4().hex[:12]}",
-        "title": video.title,
-        "description": video.description,
-        "category": video.category,
-        "video_url": embed_url,
-        "thumbnail_url": video.thumbnail_url,
-        "is_premium": video.is_premium,
-        "order": next_order,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
+    # Next order number comes from the atomic counter; the URL is converted to embed format
+    video_doc = build_video_doc(video, await reserve_video_orders(1))
     
     await db.videos.insert_one(video_doc)
+    catalog.invalidate()
     del video_doc["_id"]
+    search_index.add(video_doc)
+    category_summary.add(video_doc)
+    await invalidation_bus.publish("videos")
     return video_doc
 
+VIDEO_IMPORT_CHUNK_SIZE = 500
+VIDEO_IMPORT_MAX_ERRORS = 100
+
+@api_router.post("/admin/videos/import")
+async def import_videos(request: Request):
+    """Bulk-create videos from a streamed JSON Lines or CSV body (admin only)"""
+    user = await get_current_user(request)
+    if not user or user["email"] != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    is_csv = "csv" in request.headers.get("Content-Type", "")
+    inserted = 0
+    errors = []
+    chunk = []
+    
+    def added(docs):
+        nonlocal inserted
+        for doc in docs:
+            doc.pop("_id", None)
+            search_index.add(doc)
+            category_summary.add(doc)
+        inserted += len(docs)
+    
+    async def flush():
+        first_order = await reserve_video_orders(len(chunk))
+        docs = [build_video_doc(video, first_order + i) for i, video in enumerate(chunk)]
+        chunk.clear()
+        try:
+            await db.videos.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Unordered insert: every document without a write error was stored
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            added([doc for i, doc in enumerate(docs) if i not in failed])
+            raise
+        added(docs)
+    
+    # Rows already written must reach the catalog even if a later chunk fails
+    try:
+        async for line_number, record in iter_import_records(request, is_csv):
+            try:
+                if isinstance(record, str):
+                    raise ValueError(record)
+                chunk.append(parse_import_record(record))
+            except ValidationError as e:
+                if len(errors) < VIDEO_IMPORT_MAX_ERRORS:
+                    message = "; ".join(f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors())
+                    errors.append({"line": line_number, "error": message})
+                continue
+            except (ValueError, TypeError) as e:
+                if len(errors) < VIDEO_IMPORT_MAX_ERRORS:
+                    errors.append({"line": line_number, "error": str(e)})
+                continue
+            if len(chunk) >= VIDEO_IMPORT_CHUNK_SIZE:
+                await flush()
+        if chunk:
+            await flush()
+    finally:
+        if inserted:
+            catalog.invalidate()
+            await invalidation_bus.publish("videos")
+    return {"inserted": inserted, "errors": errors}
+
+@api_router.post("/admin/videos/reorder")
+async def reorder_videos(reorder: VideoReorder, request: Request):
+    """Set the order of many videos in one bulk write (admin only)"""
+    user = await get_current_user(request)
+    if not user or user["email"] != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    if not reorder.items:
+        return {"matched": 0, "modified": 0}
+    
+    result = await db.videos.bulk_write(
+        [UpdateOne({"video_id": item.video_id}, {"$set": {"order": item.order}}) for item in reorder.items],
+        ordered=False
+    )
+    # Keep new videos after any order assigned here
+    await db.counters.update_one(
+        {"_id": VIDEO_ORDER_COUNTER},
+        {"$max": {"value": max(item.order for item in reorder.items)}},
+        upsert=True
+    )
+    invalidate_video_state()
+    await invalidation_bus.publish("videos")
+    return {"matched": result.matched_count, "modified": result.modified_count}
+
 @api_router.post("/upload/thumbnail")
 async def upload_thumbnail(file: UploadFile = File(...), request: Request = None):
     """Upload thumbnail image (admin only)"""
@@ -344,12 +3017,46 @@ async def upload_thumbnail(file: UploadFile = File(...), request: Request = None
     if file.content_type not in allowed_types:
         raise HTTPException(status_code=400, detail="Invalid file type. Allowed: JPEG, PNG, GIF, WEBP")
     
-    # Read file and convert to base64 data URL
-    contents = await file.read()
-    base64_data = base64.b64encode(contents).decode('utf-8')
-    data_url = f"data:{file.content_type};base64,{base64_data}"
+    # Stream into the content-addressed store off the event loop
+    try:
+        name = await asyncio.to_thread(thumbnail_store.save_stream, file.file, file.content_type)
+    except ValueError:
+        raise HTTPException(status_code=413, detail="Thumbnail too large")
+    
+    # Resize/recompress in the process pool; the original is still served if this fails
+    try:
+        await asyncio.get_running_loop().run_in_executor(
+            get_thumbnail_pool(),
+            render_thumbnail_variants,
+            str(thumbnail_store.path_for(name)),
+            ThumbnailStore.VARIANT_WIDTHS,
+            int(os.environ.get("THUMBNAIL_QUALITY", "80"))
+        )
+    except Exception as e:
+        logging.warning(f"Thumbnail variant generation failed for {name}: {e}")
+    
+    return {"thumbnail_url": thumbnail_store.url_for(name)}
+
+@api_router.get("/thumbnails/{name}")
+async def get_thumbnail(name: str, request: Request, w: Optional[int] = Query(None, ge=1, le=4096)):
+    """Serve a stored thumbnail; names are content hashes so responses never change.
+
+    With ?w=, the smallest resized variant at least that wide is served, as
+    WebP when the client accepts it.
+    """
+    path = thumbnail_store.path_for(name)
+    if path is None or not path.is_file():
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
     
-    return {"thumbnail_url": data_url}
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    if w is not None:
+        accepts_webp = "image/webp" in request.headers.get("Accept", "")
+        name = thumbnail_store.pick_variant(name, w, accepts_webp)
+        path = thumbnail_store.path_for(name)
+        headers["Vary"] = "Accept"
+    headers["ETag"] = f'"{name}"'
+    
+    return FileResponse(path, headers=headers)
 
 @api_router.delete("/videos/{video_id}")
 async def delete_video(video_id: str, request: Request):
@@ -358,22 +3065,58 @@ async def delete_video(video_id: str, request: Request):
     if not user or user["email"] != ADMIN_EMAIL:
         raise HTTPException(status_code=403, detail="Admin access required")
     
-    result = await db.videos.delete_one({"video_id": video_id})
-    if result.deleted_count == 0:
+    video = await db.videos.find_one_and_delete({"video_id": video_id}, {"_id": 0, "video_id": 1, "category": 1})
+    if video is None:
         raise HTTPException(status_code=404, detail="Video not found")
+    catalog.invalidate()
+    search_index.remove(video_id)
+    category_summary.remove(video)
+    await invalidation_bus.publish("videos")
     
     return {"message": "Video deleted"}
 
-@api_router.get("/categories")
-async def get_categories():
+def cached_json_response(request: Request, body: bytes, etag: str, cache_control: str) -> Response:
+    """Send pre-serialized JSON, or 304 when the client already has this ETag"""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# Revalidate every time (cheap 304s) so a newly added category shows up at once
+CATEGORY_CACHE_CONTROL = "public, no-cache"
+
+@api_router.get("/categories", response_model=List[str])
+async def get_categories(request: Request):
     """Get video categories"""
-    categories = await db.videos.distinct("category")
-    return categories
+    await category_summary.ensure_built()
+    body, etag = category_summary.names_json()
+    return cached_json_response(request, body, etag, CATEGORY_CACHE_CONTROL)
+
+@api_router.get("/categories/summary")
+async def get_category_summary(request: Request):
+    """Get per-category video counts"""
+    await category_summary.ensure_built()
+    body, etag = category_summary.summary_json()
+    return cached_json_response(request, body, etag, CATEGORY_CACHE_CONTROL)
+
+@api_router.post("/admin/categories/rebuild")
+async def rebuild_categories(request: Request):
+    """Rebuild the category summary from the database (admin only)"""
+    user = await get_current_user(request)
+    if not user or user["email"] != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    catalog.invalidate()
+    snapshot = await catalog.get()
+    category_summary.rebuild(snapshot.videos)
+    rows, _ = category_summary.summary()
+    return rows
 
 # Payment endpoints
 @api_router.post("/payments/create-checkout")
 async def create_checkout(request: Request):
     """Create Stripe checkout session"""
+    rate_limiter.check(request, "checkout")
     user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
@@ -390,11 +3133,7 @@ async def create_checkout(request: Request):
     
     amount = SUBSCRIPTION_PLANS[plan]["price"]
     
-    # Initialize Stripe
-    api_key = os.environ.get("STRIPE_API_KEY")
-    host_url = str(request.base_url)
-    webhook_url = f"{host_url}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+    payment_gateway.bind_base_url(str(request.base_url))
     
     success_url = f"{origin_url}/payment/success?session_id={{CHECKOUT_SESSION_ID}}"
     cancel_url = f"{origin_url}/pricing"
@@ -411,7 +3150,8 @@ async def create_checkout(request: Request):
         }
     )
     
-    session = await stripe_checkout.create_checkout_session(checkout_request)
+    async with payments_bulkhead.slot():
+        session = await payment_gateway.create_checkout_session(checkout_request)
     
     # Create payment transaction record
     transaction = {
@@ -424,15 +3164,16 @@ async def create_checkout(request: Request):
         "plan": plan,
         "status": "pending",
         "payment_status": "initiated",
-        "created_at": datetime.now(timezone.utc).isoformat()
+        "created_at": datetime.now(timezone.utc)
     }
-    await db.payment_transactions.insert_one(transaction)
+    await db.payment_transactions.insert_one(PaymentTransaction(**transaction).model_dump())
     
     return {"url": session.url, "session_id": session.session_id}
 
 @api_router.get("/payments/status/{session_id}")
 async def get_payment_status(session_id: str, request: Request):
     """Get payment status and update subscription if paid"""
+    rate_limiter.check(request, "payment_status")
     user = await get_current_user(request)
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
@@ -446,13 +3187,9 @@ async def get_payment_status(session_id: str, request: Request):
             "plan": transaction.get("plan")
         }
     
-    # Get status from Stripe
-    api_key = os.environ.get("STRIPE_API_KEY")
-    host_url = str(request.base_url)
-    webhook_url = f"{host_url}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
-    
-    status = await stripe_checkout.get_checkout_status(session_id)
+    # Get status from Stripe (coalesced, cached and rate-capped)
+    payment_gateway.bind_base_url(str(request.base_url))
+    status = await payment_status_poller.get(session_id)
     
     # Update transaction
     if status.payment_status == "paid":
@@ -460,29 +3197,12 @@ async def get_payment_status(session_id: str, request: Request):
         if transaction:
             plan = transaction.get("plan", "monthly")
             
-            # Calculate expiry
-            if plan == "monthly":
-                expires = datetime.now(timezone.utc) + timedelta(days=30)
-            else:  # annual
-                expires = datetime.now(timezone.utc) + timedelta(days=365)
-            
-            # Update user subscription
-            await db.users.update_one(
-                {"user_id": user["user_id"]},
-                {"$set": {
-                    "subscription_plan": plan,
-                    "subscription_expires": expires.isoformat()
-                }}
-            )
+            # Update user subscription (no-op if the webhook already applied it)
+            await db.users.update_one(*paid_subscription_update(session_id, user["user_id"], plan))
+            await invalidate_user_sessions([user["user_id"]])
             
             # Update transaction
-            await db.payment_transactions.update_one(
-                {"session_id": session_id},
-                {"$set": {
-                    "status": "complete",
-                    "payment_status": "paid"
-                }}
-            )
+            await db.payment_transactions.update_one({"session_id": session_id}, TRANSACTION_PAID_UPDATE)
     
     return {
         "status": status.status,
@@ -497,77 +3217,309 @@ async def stripe_webhook(request: Request):
     body = await request.body()
     signature = request.headers.get("Stripe-Signature")
     
-    api_key = os.environ.get("STRIPE_API_KEY")
-    host_url = str(request.base_url)
-    webhook_url = f"{host_url}api/webhook/stripe"
-    stripe_checkout = StripeCheckout(api_key=api_key, webhook_url=webhook_url)
+    payment_gateway.bind_base_url(str(request.base_url))
     
     try:
-        event = await stripe_checkout.handle_webhook(body, signature)
-        
-        if event.payment_status == "paid":
-            # Update transaction and user
-            transaction = await db.payment_transactions.find_one(
-                {"session_id": event.session_id},
-                {"_id": 0}
-            )
-            
-            if transaction and transaction.get("payment_status") != "paid":
-                plan = event.metadata.get("plan", "monthly")
-                user_id = event.metadata.get("user_id")
-                
-                if plan == "monthly":
-                    expires = datetime.now(timezone.utc) + timedelta(days=30)
-                else:
-                    expires = datetime.now(timezone.utc) + timedelta(days=365)
-                
-                await db.users.update_one(
-                    {"user_id": user_id},
-                    {"$set": {
-                        "subscription_plan": plan,
-                        "subscription_expires": expires.isoformat()
-                    }}
-                )
-                
-                await db.payment_transactions.update_one(
-                    {"session_id": event.session_id},
-                    {"$set": {
-                        "status": "complete",
-                        "payment_status": "paid"
-                    }}
-                )
-        
-        return {"status": "ok"}
+        event = await payment_gateway.handle_webhook(body, signature)
     except Exception as e:
         logging.error(f"Webhook error: {e}")
         return {"status": "error"}
+    
+    # Persist and acknowledge; the inbox workers apply it
+    await webhook_inbox.enqueue(event)
+    return {"status": "ok"}
+
+@api_router.get("/admin/analytics/top-videos")
+async def get_top_videos(
+    request: Request,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    category: Optional[str] = None,
+    limit: int = Query(10, ge=1, le=100)
+):
+    """Most viewed videos with unique-viewer estimates, from the view rollups (admin only).
+
+    Defaults to the last 24 hours; views from the last flush interval may not be counted yet.
+    """
+    user = await get_current_user(request)
+    if not user or user["email"] != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    end = as_utc(end) if end else datetime.now(timezone.utc)
+    start = as_utc(start) if start else end - timedelta(hours=24)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    return await view_analytics.top_videos(start, end, category, limit)
+
+@api_router.get("/admin/stats")
+async def get_admin_stats(request: Request):
+    """Get in-process cache statistics (admin only)"""
+    user = await get_current_user(request)
+    if not user or user["email"] != ADMIN_EMAIL:
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return {
+        "session_cache": session_cache.stats(),
+        "session_revocations": session_revocations.stats() if session_signer is not None else None,
+        "auth_http": auth_client.stats(),
+        "payments": payment_gateway.stats(),
+        "payment_status_poller": payment_status_poller.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "upstream_bulkheads": {"auth": auth_bulkhead.stats(), "payments": payments_bulkhead.stats()},
+        "webhook_inbox": webhook_inbox.stats(),
+        "subscription_sweeper": subscription_sweeper.stats(),
+        "watch_progress": watch_progress.stats(),
+        "view_analytics": view_analytics.stats(),
+        "catalog": {"version": catalog.version, "videos": len(catalog.videos)},
+        "invalidation_bus": invalidation_bus.stats(),
+        "request_profiler": request_profiler.stats(),
+        "indexes": await get_index_stats()
+    }
+
+SUBSCRIPTION_PLANS_JSON = orjson.dumps(SUBSCRIPTION_PLANS)
+SUBSCRIPTION_PLANS_ETAG = f'"{hashlib.sha1(SUBSCRIPTION_PLANS_JSON).hexdigest()[:20]}"'
 
 @api_router.get("/plans")
-async def get_plans():
+async def get_plans(request: Request):
     """Get subscription plans"""
-    return SUBSCRIPTION_PLANS
+    return cached_json_response(request, SUBSCRIPTION_PLANS_JSON, SUBSCRIPTION_PLANS_ETAG, "public, max-age=300")
+
+@api_router.get("/bootstrap")
+async def bootstrap(request: Request):
+    """Everything the dashboard needs in one round trip: user, catalog, categories and plans.
+
+    The parts are pre-serialized, so the body is spliced together without
+    re-encoding; the ETag covers all of them.
+    """
+    # The session lookup overlaps the catalog load; the category summary is built
+    # from the catalog snapshot, so the snapshot below is then already cached
+    user, _ = await asyncio.gather(get_current_user(request), category_summary.ensure_built())
+    snapshot = await catalog.get()
+    has_premium = premium_status(user) == "active"
+    
+    videos_json, videos_etag = snapshot.json_for(has_premium)
+    categories_json, categories_etag = category_summary.names_json()
+    summary_json, _ = category_summary.summary_json()
+    user_json = UserProfile(**user_profile(user)).model_dump_json().encode("utf-8") if user else b"null"
+    
+    etag_source = b"|".join([user_json, videos_etag.encode(), categories_etag.encode(), SUBSCRIPTION_PLANS_ETAG.encode()])
+    etag = f'W/"{hashlib.sha1(etag_source).hexdigest()[:20]}"'
+    body = b"".join([
+        b'{"user":', user_json,
+        b',"videos":', videos_json,
+        b',"categories":', categories_json,
+        b',"category_summary":', summary_json,
+        b',"plans":', SUBSCRIPTION_PLANS_JSON,
+        b"}"
+    ])
+    response = cached_json_response(request, body, etag, "private, no-cache")
+    if user:
+        refresh_stale_session(request, response, user)
+    return response
 
 @api_router.get("/")
 async def root():
     return {"message": "Iron Hold Wrestling API"}
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(request: Request):
+    """Prometheus scrape endpoint; set METRICS_TOKEN to require a bearer token"""
+    token = os.environ.get("METRICS_TOKEN")
+    if token and request.headers.get("Authorization") != f"Bearer {token}":
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(content=render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 # Include router
 app.include_router(api_router)
 
+class StackSampler:
+    """Samples the event-loop thread's stack from a helper thread while sampled requests run.
+
+    A sample counts toward a request only if that request's middleware frame
+    is on the stack, so concurrent requests don't leak into each other's
+    profiles. Stacks are appended in collapsed format ("root;...;leaf count"),
+    which flamegraph.pl and speedscope read directly.
+    """
+
+    def __init__(self, interval_seconds: float, output_path: Path):
+        self.interval_seconds = interval_seconds
+        self.output_path = output_path
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._loop_thread_id = None
+
+    def begin(self, frame):
+        with self._lock:
+            self._active[frame] = {}
+            self._loop_thread_id = threading.get_ident()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-stack-sampler", daemon=True)
+                self._thread.start()
+
+    def end(self, frame) -> dict:
+        with self._lock:
+            return self._active.pop(frame, {})
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                frame = sys._current_frames().get(self._loop_thread_id)
+                names = []
+                while frame is not None:
+                    stacks = self._active.get(frame)
+                    if stacks is not None:
+                        key = ";".join(reversed(names))
+                        stacks[key] = stacks.get(key, 0) + 1
+                        break
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ","))
+                    frame = frame.f_back
+            time.sleep(self.interval_seconds)
+
+    def write(self, label: str, stacks: dict):
+        """Append one request's stacks, rooted at its label. Blocking - call from a worker thread."""
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.output_path, "a") as output:
+            for stack, count in stacks.items():
+                output.write(f"{label};{stack} {count}\n" if stack else f"{label} {count}\n")
+
+class RequestProfiler:
+    """Query/latency budgets and stack sampling for the REQUEST_PROFILING debug mode"""
+
+    def __init__(self, enabled: bool, max_queries: int, max_ms: float, sample_rate: float, sampler: StackSampler):
+        self.enabled = enabled
+        self.max_queries = max_queries
+        self.max_ms = max_ms
+        self.sample_rate = sample_rate
+        self.sampler = sampler
+        self.requests = 0
+        self.over_budget = 0
+        self.sampled = 0
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "max_queries": self.max_queries,
+            "max_ms": self.max_ms,
+            "sample_rate": self.sample_rate,
+            "requests": self.requests,
+            "over_budget": self.over_budget,
+            "sampled": self.sampled
+        }
+
+request_profiler = RequestProfiler(
+    enabled=os.environ.get("REQUEST_PROFILING", "0") == "1",
+    max_queries=int(os.environ.get("QUERY_BUDGET_MAX_QUERIES", "3")),
+    max_ms=float(os.environ.get("QUERY_BUDGET_MAX_MS", "50")),
+    sample_rate=float(os.environ.get("REQUEST_PROFILE_SAMPLE_RATE", "0")),
+    sampler=StackSampler(
+        interval_seconds=float(os.environ.get("REQUEST_PROFILE_INTERVAL_MS", "5")) / 1000,
+        output_path=Path(os.environ.get("REQUEST_PROFILE_OUTPUT", str(ROOT_DIR / "profiles" / "requests.folded")))
+    )
+)
+
+class RequestProfilerMiddleware:
+    """Logs requests over the query/latency budget with a breakdown and samples a share of them"""
+
+    def __init__(self, app, profiler: RequestProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        profiler = self.profiler
+        profile = RequestProfile()
+        token = current_request_profile.set(profile)
+        
+        async def send_counting(message):
+            if message["type"] == "http.response.body":
+                profile.response_bytes += len(message.get("body", b""))
+            await send(message)
+        
+        frame = sys._getframe() if random.random() < profiler.sample_rate else None
+        if frame is not None:
+            profiler.sampler.begin(frame)
+        try:
+            await self.app(scope, receive, send_counting)
+        finally:
+            current_request_profile.reset(token)
+            elapsed = time.perf_counter() - profile.started
+            # The router records the matched route in the scope; fall back to the raw path
+            label = f"{scope['method']} {getattr(scope.get('route'), 'path', scope['path'])}"
+            profiler.requests += 1
+            if profile.mongo_calls > profiler.max_queries or elapsed * 1000 > profiler.max_ms:
+                profiler.over_budget += 1
+                logging.warning(f"Request over budget: {label} {profile.describe(elapsed)}")
+            if frame is not None:
+                profiler.sampled += 1
+                stacks = profiler.sampler.end(frame)
+                if stacks:
+                    try:
+                        await asyncio.to_thread(profiler.sampler.write, label, stacks)
+                    except OSError as e:
+                        logging.error(f"Could not write request profile: {e}")
+
+class MetricsMiddleware:
+    """Times every HTTP request and tracks in-flight requests, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        # Label by template ("/api/videos/{video_id}") to keep series bounded
+        route = "unmatched"
+        for candidate in scope["app"].router.routes:
+            match, _ = candidate.matches(scope)
+            if match == Match.FULL:
+                route = candidate.path
+                break
+            if match == Match.PARTIAL and route == "unmatched":
+                route = candidate.path
+        
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+        
+        in_flight_labels = (scope["method"], route)
+        HTTP_REQUESTS_IN_FLIGHT.inc(in_flight_labels)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_FLIGHT.dec(in_flight_labels)
+            HTTP_REQUEST_SECONDS.observe((scope["method"], route, str(status)), time.perf_counter() - started)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "Retry-After"],
 )
 
+app.add_middleware(MetricsMiddleware)
+if request_profiler.enabled:
+    app.add_middleware(RequestProfilerMiddleware, profiler=request_profiler)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
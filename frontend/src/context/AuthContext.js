@@ -68,6 +68,7 @@ export const AuthProvider = ({ children }) => {
       logout, 
       processSession,
       refreshUser,
+      setUser,
       isAdmin: user?.is_admin || false,
       isPremium: user?.subscription_plan === 'monthly' || user?.subscription_plan === 'annual'
     }}>
@@ -4,3 +4,17 @@ import { twMerge } from "tailwind-merge"
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// Backend-served assets (e.g. /api/thumbnails/...) are stored as relative paths
+export function assetUrl(url) {
+  if (url && url.startsWith('/')) {
+    return `${process.env.REACT_APP_BACKEND_URL}${url}`;
+  }
+  return url;
+}
+
+// Resized variants of backend thumbnails, picked by the browser per viewport
+export function thumbnailSrcSet(url) {
+  if (!url || !url.startsWith('/api/thumbnails/')) return undefined;
+  return [320, 640, 1280].map((w) => `${assetUrl(url)}?w=${w} ${w}w`).join(', ');
+}
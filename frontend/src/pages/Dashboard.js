@@ -12,11 +12,12 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from '.
 import { toast } from 'sonner';
 import axios from 'axios';
 import Navbar from '../components/Navbar';
+import { assetUrl, thumbnailSrcSet } from '../lib/utils';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
 
 export default function Dashboard() {
-  const { user, isAdmin, isPremium, loading } = useAuth();
+  const { user, isAdmin, isPremium, loading, setUser } = useAuth();
   const navigate = useNavigate();
   const [videos, setVideos] = useState([]);
   const [categories, setCategories] = useState([]);
@@ -37,25 +38,18 @@ export default function Dashboard() {
   });
 
   useEffect(() => {
-    fetchVideos();
-    fetchCategories();
+    fetchDashboard();
   }, []);
 
-  const fetchVideos = async () => {
+  // User, catalog and categories arrive in one round trip (revalidated with ETags)
+  const fetchDashboard = async () => {
     try {
-      const response = await axios.get(`${API}/videos`, { withCredentials: true });
-      setVideos(response.data);
+      const response = await axios.get(`${API}/bootstrap`, { withCredentials: true });
+      setUser(response.data.user);
+      setVideos(response.data.videos);
+      setCategories(response.data.categories);
     } catch (error) {
-      console.error('Error fetching videos:', error);
-    }
-  };
-
-  const fetchCategories = async () => {
-    try {
-      const response = await axios.get(`${API}/categories`);
-      setCategories(response.data);
-    } catch (error) {
-      console.error('Error fetching categories:', error);
+      console.error('Error fetching dashboard:', error);
     }
   };
 
@@ -122,8 +116,7 @@ export default function Dashboard() {
         is_premium: false
       });
       setThumbnailPreview(null);
-      fetchVideos();
-      fetchCategories();
+      fetchDashboard();
     } catch (error) {
       toast.error('Failed to add video');
       console.error('Upload error:', error);
@@ -138,7 +131,7 @@ export default function Dashboard() {
     try {
       await axios.delete(`${API}/videos/${videoId}`, { withCredentials: true });
       toast.success('Video deleted');
-      fetchVideos();
+      fetchDashboard();
     } catch (error) {
       toast.error('Failed to delete video');
     }
@@ -242,7 +235,9 @@ export default function Dashboard() {
                 <div className="relative aspect-video bg-[#27272a]">
                   {video.thumbnail_url ? (
                     <img 
-                      src={video.thumbnail_url} 
+                      src={assetUrl(video.thumbnail_url)} 
+                      srcSet={thumbnailSrcSet(video.thumbnail_url)}
+                      sizes="(min-width: 1024px) 33vw, (min-width: 768px) 50vw, 100vw"
                       alt={video.title}
                       className="w-full h-full object-cover"
                     />
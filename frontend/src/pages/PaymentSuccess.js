@@ -50,6 +50,12 @@ export default function PaymentSuccess() {
         setTimeout(() => pollPaymentStatus(sessionId), 2000);
       }
     } catch (error) {
+      // Rate limited or upstream busy: try again when the server says to
+      const retryAfter = Number(error.response?.headers?.['retry-after']);
+      if ([429, 503].includes(error.response?.status) && retryAfter > 0) {
+        setTimeout(() => pollPaymentStatus(sessionId), retryAfter * 1000);
+        return;
+      }
       console.error('Payment status error:', error);
       setStatus('error');
     }
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { useAuth } from '../context/AuthContext';
 import { motion } from 'framer-motion';
@@ -9,6 +9,18 @@ import axios from 'axios';
 import Navbar from '../components/Navbar';
 
 const API = `${process.env.REACT_APP_BACKEND_URL}/api`;
+const HEARTBEAT_INTERVAL_MS = 15000;
+const YOUTUBE_ORIGIN = 'https://www.youtube.com';
+
+// Ask the embed for playback events and resume from the saved position
+function playerUrl(videoUrl, startAt) {
+  if (!videoUrl || !videoUrl.startsWith(`${YOUTUBE_ORIGIN}/embed/`)) return videoUrl;
+  const url = new URL(videoUrl);
+  url.searchParams.set('enablejsapi', '1');
+  url.searchParams.set('origin', window.location.origin);
+  if (startAt > 0) url.searchParams.set('start', String(Math.floor(startAt)));
+  return url.toString();
+}
 
 export default function VideoPlayer() {
   const { videoId } = useParams();
@@ -17,14 +29,76 @@ export default function VideoPlayer() {
   const [video, setVideo] = useState(null);
   const [error, setError] = useState(null);
   const [videoLoading, setVideoLoading] = useState(true);
+  const [startAt, setStartAt] = useState(0);
+  const iframeRef = useRef(null);
+  const playback = useRef({ position: null, duration: null, reported: null });
 
   useEffect(() => {
     fetchVideo();
   }, [videoId]);
 
+  // The YouTube embed posts its current time once we start listening
+  useEffect(() => {
+    const onMessage = (event) => {
+      if (event.origin !== YOUTUBE_ORIGIN || event.source !== iframeRef.current?.contentWindow) return;
+      let data;
+      try {
+        data = JSON.parse(event.data);
+      } catch {
+        return;
+      }
+      if (data.event === 'infoDelivery' && data.info) {
+        if (typeof data.info.currentTime === 'number') playback.current.position = data.info.currentTime;
+        if (data.info.duration > 0) playback.current.duration = data.info.duration;
+      }
+    };
+    window.addEventListener('message', onMessage);
+    return () => window.removeEventListener('message', onMessage);
+  }, []);
+
+  // Heartbeats are coalesced server-side, so only changed positions are sent
+  useEffect(() => {
+    if (!user || !video) return undefined;
+    playback.current = { position: null, duration: null, reported: null };
+    const report = (keepalive = false) => {
+      const { position, duration, reported } = playback.current;
+      if (position === null || position === reported) return;
+      playback.current.reported = position;
+      const body = { position_seconds: position, duration_seconds: duration };
+      if (keepalive) {
+        fetch(`${API}/videos/${videoId}/progress`, {
+          method: 'POST',
+          credentials: 'include',
+          keepalive: true,
+          headers: { 'Content-Type': 'application/json' },
+          body: JSON.stringify(body),
+        }).catch(() => {});
+      } else {
+        axios.post(`${API}/videos/${videoId}/progress`, body, { withCredentials: true }).catch(() => {});
+      }
+    };
+    const interval = setInterval(report, HEARTBEAT_INTERVAL_MS);
+    const onPageHide = () => report(true);
+    window.addEventListener('pagehide', onPageHide);
+    return () => {
+      clearInterval(interval);
+      window.removeEventListener('pagehide', onPageHide);
+      report(true);
+    };
+  }, [user, video, videoId]);
+
+  const listenToPlayer = () => {
+    iframeRef.current?.contentWindow?.postMessage(JSON.stringify({ event: 'listening', id: videoId }), YOUTUBE_ORIGIN);
+  };
+
   const fetchVideo = async () => {
     try {
-      const response = await axios.get(`${API}/videos/${videoId}`, { withCredentials: true });
+      const [response, progress] = await Promise.all([
+        axios.get(`${API}/videos/${videoId}`, { withCredentials: true }),
+        // Anonymous viewers get a 401 here and simply start from the beginning
+        axios.get(`${API}/videos/${videoId}/progress`, { withCredentials: true }).catch(() => null),
+      ]);
+      setStartAt(progress && !progress.data.completed ? progress.data.position_seconds : 0);
       setVideo(response.data);
       setError(null);
     } catch (error) {
@@ -140,8 +214,10 @@ export default function VideoPlayer() {
         >
           <div className="aspect-video bg-black">
             <iframe
+              ref={iframeRef}
               data-testid="video-player"
-              src={video.video_url}
+              src={playerUrl(video.video_url, startAt)}
+              onLoad={listenToPlayer}
               title={video.title}
               className="w-full h-full"
               allow="accelerometer; autoplay; clipboard-write; encrypted-media; gyroscope; picture-in-picture"
@@ -0,0 +1,105 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+# server.py needs the private emergentintegrations package for Stripe
+pytest.importorskip("emergentintegrations")
+
+import server
+
+class StreamedRequest:
+    def __init__(self, chunks):
+        self.chunks = chunks
+    
+    async def stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+def collect(chunks, is_csv):
+    async def run():
+        return [record async for record in server.iter_import_records(StreamedRequest(chunks), is_csv)]
+    return asyncio.run(run())
+
+def split_everywhere(body):
+    for cut in range(1, len(body)):
+        yield [body[:cut], body[cut:]]
+
+def test_json_lines_split_inside_multibyte_characters():
+    body = '{"title": "Déjà vu"}\n{"title": "Ünïcödé ✓"}'.encode("utf-8")
+    for chunks in split_everywhere(body):
+        assert collect(chunks, is_csv=False) == [(1, {"title": "Déjà vu"}), (2, {"title": "Ünïcödé ✓"})]
+
+def test_csv_split_inside_multibyte_characters():
+    body = 'title,category\n"Déjà, vu",Élan ✓\n'.encode("utf-8")
+    for chunks in split_everywhere(body):
+        assert collect(chunks, is_csv=True) == [(2, {"title": "Déjà, vu", "category": "Élan ✓"})]
+
+def test_single_byte_chunks():
+    body = '{"title": "€"}'.encode("utf-8")
+    assert collect([bytes([byte]) for byte in body], is_csv=False) == [(1, {"title": "€"})]
+
+class ImportRequest(StreamedRequest):
+    headers = {"Content-Type": "application/x-ndjson"}
+
+class FakeVideos:
+    def __init__(self, fail_on_call=None):
+        self.docs = []
+        self.calls = 0
+        self.fail_on_call = fail_on_call
+    
+    async def insert_many(self, docs, ordered):
+        self.calls += 1
+        for doc in docs:
+            doc["_id"] = doc["video_id"]
+        if self.calls == self.fail_on_call:
+            # The first document is stored, the rest hit a write error
+            self.docs.append(docs[0])
+            raise BulkWriteError({"writeErrors": [{"index": i, "code": 11000} for i in range(1, len(docs))]})
+        self.docs.extend(docs)
+
+@pytest.fixture
+def import_env(monkeypatch):
+    published = []
+    invalidations = []
+    order = iter(range(1, 10 ** 6, 1000))
+    
+    async def admin(request):
+        return {"email": server.ADMIN_EMAIL}
+    
+    async def reserve(count):
+        return next(order)
+    
+    async def publish(topic, keys=(None,)):
+        published.append(topic)
+    
+    monkeypatch.setattr(server, "get_current_user", admin)
+    monkeypatch.setattr(server, "reserve_video_orders", reserve)
+    monkeypatch.setattr(server.invalidation_bus, "publish", publish)
+    monkeypatch.setattr(server.catalog, "invalidate", lambda: invalidations.append(True))
+    monkeypatch.setattr(server, "VIDEO_IMPORT_CHUNK_SIZE", 2)
+    return SimpleNamespace(published=published, invalidations=invalidations, monkeypatch=monkeypatch)
+
+def video_line(title):
+    return json.dumps({"title": title, "description": "d", "category": "c", "video_url": "https://youtu.be/abc"})
+
+def run_import(import_env, videos, lines):
+    import_env.monkeypatch.setattr(server, "db", SimpleNamespace(videos=videos))
+    body = "\n".join(lines).encode("utf-8")
+    return asyncio.run(server.import_videos(ImportRequest([body])))
+
+def test_non_object_json_lines_are_reported_per_line(import_env):
+    result = run_import(import_env, FakeVideos(), [video_line("a"), "[1]", "3", '"text"', "null", video_line("b")])
+    assert result["inserted"] == 2
+    assert [error["line"] for error in result["errors"]] == [2, 3, 4, 5]
+    assert import_env.published == ["videos"]
+
+def test_failed_chunk_still_refreshes_the_catalog(import_env):
+    videos = FakeVideos(fail_on_call=2)
+    with pytest.raises(BulkWriteError):
+        run_import(import_env, videos, [video_line(str(i)) for i in range(6)])
+    # First chunk plus the one document of the second that was stored
+    assert len(videos.docs) == 3
+    assert import_env.invalidations and import_env.published == ["videos"]
@@ -0,0 +1,32 @@
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+# server.py needs the private emergentintegrations package for Stripe
+pytest.importorskip("emergentintegrations")
+
+import server
+
+def make_request(forwarded_for=None, client="10.0.0.1"):
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": headers, "client": (client, 1234)})
+
+def test_clients_behind_the_ingress_get_their_own_buckets():
+    limiter = server.RateLimiter({"login": (0.001, 2)}, proxy_hops=1)
+    for _ in range(2):
+        limiter.check(make_request("203.0.113.5"), "login")
+    with pytest.raises(HTTPException) as error:
+        limiter.check(make_request("203.0.113.5"), "login")
+    assert error.value.status_code == 429
+    limiter.check(make_request("198.51.100.7"), "login")
+
+def test_only_the_entry_written_by_our_proxy_is_trusted():
+    limiter = server.RateLimiter({"login": (0.001, 1)}, proxy_hops=1)
+    limiter.check(make_request("1.1.1.1, 203.0.113.5"), "login")
+    with pytest.raises(HTTPException):
+        limiter.check(make_request("2.2.2.2, 203.0.113.5"), "login")
+
+def test_direct_connections_fall_back_to_the_peer_address():
+    limiter = server.RateLimiter({"login": (0.001, 1)}, proxy_hops=1)
+    assert limiter.client_ip(make_request(client="192.0.2.9")) == "192.0.2.9"
+    assert server.RateLimiter({}, proxy_hops=0).client_ip(make_request("203.0.113.5")) == "10.0.0.1"
@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+# server.py needs the private emergentintegrations package for Stripe
+pytest.importorskip("emergentintegrations")
+
+import server
+
+WORDS = "single double leg ankle pick sweep sprawl cradle tilt whizzer arm drag snap down".split()
+
+def make_videos(count, rng):
+    return [
+        {
+            "video_id": f"vid_{i:06d}",
+            "title": " ".join(rng.choices(WORDS, k=rng.randint(1, 4))),
+            "description": " ".join(rng.choices(WORDS, k=rng.randint(0, 8))),
+            "category": rng.choice(["Takedowns", "Escapes", "Pins"]),
+            "order": i,
+        }
+        for i in range(count)
+    ]
+
+def brute_force_search(index, query, limit):
+    """Score every video with the index's formula, without early termination"""
+    terms = index.tokenize(query)
+    if not terms:
+        return []
+    total = len(index.videos)
+    groups = []
+    for position, term in enumerate(terms):
+        expansions = [term] if term in index.postings else []
+        if position == len(terms) - 1 and len(term) >= 2:
+            expansions = index._prefix_terms(term) or expansions
+        if not expansions:
+            return []
+        groups.append([
+            (expansion, server.math.log(1 + total / len(index.postings[expansion])) * (1.0 if expansion == term else 0.5))
+            for expansion in expansions
+        ])
+    groups.sort(key=lambda group: sum(len(index.postings[term]) for term, _ in group))
+    
+    ranked = []
+    for video_id, video in index.videos.items():
+        score = 0.0
+        for group in groups:
+            best = max(index.postings[term].get(video_id, 0.0) * factor for term, factor in group)
+            if not best:
+                break
+            score += best
+        else:
+            ranked.append((score, -video["order"], video_id))
+    ranked.sort(reverse=True)
+    return [video_id for _, _, video_id in ranked[:limit]]
+
+QUERIES = ["single", "ankle pick", "single ankle", "leg sw", "arm drag snap", "cra", "tilt whizzer sprawl", "down d"]
+
+def test_search_matches_brute_force_without_the_scan_cap():
+    rng = random.Random(7)
+    index = server.SearchIndex()
+    index.MAX_SCANNED = 10 ** 9
+    index.rebuild(make_videos(3000, rng))
+    for query in QUERIES:
+        for limit in (1, 5, 20):
+            expected = brute_force_search(index, query, limit)
+            assert [video["video_id"] for video in index.search(query, limit)] == expected, (query, limit)
+
+def test_capped_search_returns_as_many_results_as_match():
+    rng = random.Random(11)
+    index = server.SearchIndex()
+    index.MAX_SCANNED = 16
+    index.rebuild(make_videos(3000, rng))
+    for query in QUERIES:
+        for limit in (5, 20):
+            matches = set(brute_force_search(index, query, len(index.videos)))
+            results = [video["video_id"] for video in index.search(query, limit)]
+            assert len(results) == min(limit, len(matches)), (query, limit)
+            assert set(results) <= matches, (query, limit)
+
+def test_search_finds_matches_beyond_the_rarest_terms_best_postings():
+    videos = []
+    for i in range(2000):
+        words = []
+        if i < 1000:
+            words.append("single")
+        if i >= 990:
+            words.append("ankle")
+        videos.append({"video_id": f"vid_{i:06d}", "title": " ".join(words), "description": "", "category": "x", "order": i})
+    index = server.SearchIndex()
+    index.rebuild(videos)
+    results = index.search("single ankle", limit=20)
+    assert sorted(video["video_id"] for video in results) == [f"vid_{i:06d}" for i in range(990, 1000)]
+
+def test_tokenize_keeps_accented_words_whole():
+    assert server.SearchIndex.tokenize("Déjà vu, Straße_2") == ["deja", "vu", "strasse", "2"]
+    index = server.SearchIndex()
+    index.rebuild([{"video_id": "v1", "title": "Déjà vu", "description": "", "category": "x", "order": 1}])
+    assert [video["video_id"] for video in index.search("dej")] == ["v1"]
+    assert [video["video_id"] for video in index.search("DÉJÀ")] == ["v1"]
@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# server.py needs the private emergentintegrations package for Stripe
+pytest.importorskip("emergentintegrations")
+
+import server
+
+USER = {"user_id": "user_1", "email": "ana@example.com", "name": "Ana", "subscription_plan": "free"}
+
+def issue(signer, expires_in=timedelta(days=1)):
+    return signer.issue("session_1", USER, datetime.now(timezone.utc) + expires_in)
+
+def test_round_trip():
+    signer = server.SessionSigner(b"secret")
+    claims = signer.verify(issue(signer))
+    assert claims["sid"] == "session_1"
+    assert claims["uid"] == "user_1"
+
+def test_tampered_token_is_rejected():
+    signer = server.SessionSigner(b"secret")
+    payload, _, signature = issue(signer).rpartition(".")
+    flipped = "A" if signature[0] != "A" else "B"
+    assert signer.verify(f"{payload}.{flipped}{signature[1:]}") is None
+    assert signer.verify(f"{payload}x.{signature}") is None
+    assert server.SessionSigner(b"other").verify(f"{payload}.{signature}") is None
+
+def test_expired_token_is_rejected():
+    signer = server.SessionSigner(b"secret")
+    assert signer.verify(issue(signer, expires_in=timedelta(seconds=-1))) is None
+
+def test_malformed_tokens_are_rejected():
+    signer = server.SessionSigner(b"secret")
+    for token in ["v1.é.x", "v1.abc.déf", "v1.é.déf", "v1.abc", "v1.", "", "no-prefix.abc.def"]:
+        assert signer.verify(token) is None, token
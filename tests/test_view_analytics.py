@@ -0,0 +1,44 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+# server.py needs the private emergentintegrations package for Stripe
+pytest.importorskip("emergentintegrations")
+
+import server
+
+class FailingRollups:
+    """Applies every write except the first `day` rollup, which reports a write error"""
+    
+    def __init__(self):
+        self.views = {}
+        self.fail_next_day = True
+    
+    async def bulk_write(self, operations, ordered):
+        errors = []
+        for index, operation in enumerate(operations):
+            granularity = operation._filter["granularity"]
+            if granularity == "day" and self.fail_next_day:
+                self.fail_next_day = False
+                errors.append({"index": index, "code": 11000, "errmsg": "duplicate key"})
+                continue
+            key = (granularity, operation._filter["video_id"])
+            self.views[key] = self.views.get(key, 0) + operation._doc["$inc"]["views"]
+        if errors:
+            raise BulkWriteError({"writeErrors": errors})
+
+def test_failed_rollup_is_retried_without_double_counting_the_other(monkeypatch):
+    rollups = FailingRollups()
+    monkeypatch.setattr(server, "db", SimpleNamespace(video_view_rollups=rollups))
+    analytics = server.ViewAnalytics(flush_seconds=60, batch_size=100, hourly_retention_days=30)
+    for viewer in ("a", "b", "c"):
+        analytics.record({"video_id": "v1", "category": "Takedowns"}, viewer)
+    
+    with pytest.raises(BulkWriteError):
+        asyncio.run(analytics.flush())
+    assert rollups.views == {("hour", "v1"): 3}
+    
+    asyncio.run(analytics.flush())
+    assert rollups.views == {("hour", "v1"): 3, ("day", "v1"): 3}